@@ -0,0 +1,7 @@
+'''
+weblog 的压力测试
+
+- seed ：批量生成用户、关注关系、博客和评论
+- load ：并发访问首页、博客页、用户主页、粉丝列表和登录，统计耗时分位数和 SQL 次数
+- 命令行入口见 __main__.py ，结果与基准文件比较，性能下降时退出码为 1
+'''
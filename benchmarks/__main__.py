@@ -0,0 +1,147 @@
+'''
+压力测试的命令行入口，在仓库根目录执行：
+
+    python -m benchmarks --save            # 生成基准文件
+    python -m benchmarks                   # 与基准比较，性能下降时退出码为 1
+
+数据库默认是临时目录中的 SQLite 文件，也可以通过 --database 或
+环境变量 TEST_DATABASE_URL 指定 MySQL 等数据库，测试开始时会清空该数据库。
+'''
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks',
+            description='weblog 压力测试')
+    parser.add_argument('--database', default=os.environ.get(
+            'TEST_DATABASE_URL') or 'sqlite:///' + os.path.join(
+            tempfile.gettempdir(), 'weblog-benchmark.db'),
+            help='测试使用的数据库，会被清空')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--follows', type=int, default=20,
+            help='每个用户关注的人数')
+    parser.add_argument('--blogs', type=int, default=5,
+            help='平均每个用户的博客数')
+    parser.add_argument('--comments', type=int, default=3,
+            help='每篇博客的评论数')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--anonymous', action='store_true',
+            help='以未登录用户访问，测试页面缓存命中时的性能')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+            help='基准文件的路径')
+    parser.add_argument('--save', action='store_true',
+            help='把本次结果写入基准文件，不做比较')
+    parser.add_argument('--output', help='把本次结果写入该文件')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+            help='允许的耗时增加和吞吐量下降比例')
+    parser.add_argument('--min-delta-ms', type=float, default=2.0,
+            help='耗时增加不超过该毫秒数时视为测量误差')
+    return parser.parse_args(argv)
+
+
+def compare(result, baseline, tolerance, min_delta_ms):
+    '''返回性能下降的描述列表，列表为空表示没有下降'''
+    problems = []
+    if result['scale'] != baseline['scale']:
+        problems.append('数据规模与基准不同：{} != {}'.format(
+                result['scale'], baseline['scale']))
+        return problems
+    for name, old in baseline['endpoints'].items():
+        new = result['endpoints'].get(name)
+        if new is None:
+            problems.append('{}：本次没有测试'.format(name))
+            continue
+        if new['errors'] > old['errors']:
+            problems.append('{}：错误数 {} -> {}'.format(name, old['errors'],
+                    new['errors']))
+        # SQL 次数不受机器负载影响，增加了就说明出现了多余的查询
+        if new['queries'] > old['queries'] + 0.5:
+            problems.append('{}：每个请求的 SQL 次数 {} -> {}'.format(name,
+                    old['queries'], new['queries']))
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if new[key] > old[key] * (1 + tolerance) and \
+                    new[key] - old[key] > min_delta_ms:
+                problems.append('{}：{} {} -> {}'.format(name, key, old[key],
+                        new[key]))
+        if new['throughput'] < old['throughput'] * (1 - tolerance):
+            problems.append('{}：吞吐量 {} -> {}'.format(name,
+                    old['throughput'], new['throughput']))
+    return problems
+
+
+def report(result):
+    print('{:<16}{:>8}{:>8}{:>10}{:>10}{:>10}{:>10}{:>9}'.format('endpoint',
+            'reqs', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms',
+            'queries'))
+    for name, row in result['endpoints'].items():
+        print('{:<16}{:>8}{:>8}{:>10}{:>10}{:>10}{:>10}{:>9}'.format(name,
+                row['requests'], row['errors'], row['throughput'],
+                row['p50_ms'], row['p95_ms'], row['p99_ms'], row['queries']))
+    print('总计 {} 个请求，用时 {} 秒，{} req/s'.format(
+            sum(r['requests'] for r in result['endpoints'].values()),
+            result['duration'], result['throughput']))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # 配置类在导入时读取环境变量，必须在导入 weblog 之前设置
+    os.environ['TEST_DATABASE_URL'] = args.database
+    from weblog.app import create_app
+    from weblog.models import db
+    from . import seed, load
+
+    app = create_app('test')
+    with app.app_context():
+        db.drop_all()
+        counts = seed.seed(args.users, args.follows, args.blogs,
+                args.comments, seed=args.seed)
+        db.session.remove()
+    print('已生成数据：{}'.format(counts))
+
+    scale = dict(counts, requests=args.requests,
+            concurrency=args.concurrency, anonymous=args.anonymous)
+    result = load.run(app, scale, args.requests, args.concurrency,
+            args.anonymous, seed=args.seed)
+    result['scale'] = scale
+    result['environment'] = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'database': args.database.split(':')[0],
+    }
+    report(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print('已写入基准文件 {}'.format(args.baseline))
+        return 0
+    if not os.path.exists(args.baseline):
+        print('基准文件 {} 不存在，使用 --save 生成'.format(args.baseline))
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    problems = compare(result, baseline, args.tolerance, args.min_delta_ms)
+    if problems:
+        print('性能低于基准：')
+        for problem in problems:
+            print('  ' + problem)
+        return 1
+    print('性能没有低于基准')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+'''
+比较线程模式和 gevent 模式的吞吐量，在仓库根目录执行：
+
+    python -m benchmarks.concurrency --idle 500 --concurrency 64
+
+两种服务器依次在单独的进程中启动，使用同一份数据和同样的请求序列。
+压测之前先建立 --idle 个空闲的 keep-alive 连接并一直保持，
+模拟大量保持连接的客户端；结果中的 threads 为压测结束时服务器进程的线程数。
+SQLite 的读写不会让出 CPU ，要看到 gevent 在等待 I/O 时的优势，
+应通过 --database 使用 MySQL 等网络数据库。需要安装 gevent 。
+'''
+
+import argparse
+import http.client
+import os
+import subprocess
+import sys
+import tempfile
+
+SERVERS = ('threaded', 'gevent')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.concurrency',
+            description='比较线程模式和 gevent 模式')
+    parser.add_argument('--database', default=os.environ.get(
+            'TEST_DATABASE_URL') or 'sqlite:///' + os.path.join(
+            tempfile.gettempdir(), 'weblog-concurrency.db'),
+            help='测试使用的数据库，会被清空')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--follows', type=int, default=20)
+    parser.add_argument('--blogs', type=int, default=5)
+    parser.add_argument('--comments', type=int, default=3)
+    parser.add_argument('--requests', type=int, default=3000)
+    parser.add_argument('--concurrency', type=int, default=64,
+            help='同时发送请求的客户端数量')
+    parser.add_argument('--idle', type=int, default=500,
+            help='保持的空闲 keep-alive 连接数，注意进程的文件描述符上限')
+    parser.add_argument('--anonymous', action='store_true')
+    parser.add_argument('--servers', default=','.join(SERVERS),
+            help='要测试的服务器，逗号分隔')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def thread_count(pid):
+    '''进程的线程数，只支持 Linux'''
+    try:
+        with open('/proc/{}/status'.format(pid)) as f:
+            for line in f:
+                if line.startswith('Threads:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def open_idle(port, count):
+    '''建立 count 个完成过一次请求、之后保持空闲的连接'''
+    connections = []
+    for i in range(count):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        conn.request('GET', '/static/main.css')
+        conn.getresponse().read()
+        connections.append(conn)
+    return connections
+
+
+def measure(mode, args, scale):
+    from . import load
+
+    env = dict(os.environ, TEST_DATABASE_URL=args.database)
+    process = subprocess.Popen([sys.executable, '-m', 'benchmarks.serve',
+            mode], stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env,
+            universal_newlines=True)
+    try:
+        line = process.stdout.readline()
+        if not line.strip():
+            process.wait()
+            return {'error': process.stderr.read().strip().splitlines()[-1]}
+        port = int(line)
+        idle = open_idle(port, args.idle)
+        result = load.drive('127.0.0.1', port, scale, args.requests,
+                args.concurrency, args.anonymous, seed=args.seed)
+        result['threads'] = thread_count(process.pid)
+        for conn in idle:
+            conn.close()
+        return result
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.environ['TEST_DATABASE_URL'] = args.database
+    from weblog.app import create_app
+    from weblog.models import db
+    from . import seed
+
+    app = create_app('test')
+    with app.app_context():
+        db.drop_all()
+        counts = seed.seed(args.users, args.follows, args.blogs,
+                args.comments, seed=args.seed)
+        db.session.remove()
+    print('已生成数据：{}'.format(counts))
+    scale = dict(counts, requests=args.requests,
+            concurrency=args.concurrency, anonymous=args.anonymous)
+
+    # p99 取各个 endpoint 中最大的一个
+    print('{:<10}{:>10}{:>10}{:>10}{:>9}{:>9}'.format('server', 'req/s',
+            'mean ms', 'p99 ms', 'errors', 'threads'))
+    for mode in args.servers.split(','):
+        result = measure(mode, args, scale)
+        if 'error' in result:
+            print('{:<10}启动失败：{}'.format(mode, result['error']))
+            continue
+        rows = result['endpoints'].values()
+        samples = sum(row['requests'] for row in rows)
+        print('{:<10}{:>10}{:>10}{:>10}{:>9}{:>9}'.format(mode,
+                result['throughput'],
+                round(sum(row['mean_ms'] * row['requests'] for row in rows)
+                      / samples, 2) if samples else 0,
+                max(row['p99_ms'] for row in rows),
+                sum(row['errors'] for row in rows),
+                result['threads'] if result['threads'] is not None else '-'))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,229 @@
+'''
+并发的 HTTP 压力测试
+
+在本进程中启动多线程的 WSGI 服务器，多个客户端线程按权重随机访问各个页面，
+客户端记录每个请求的耗时，每个请求执行的 SQL 次数从 weblog.metrics 的统计中读取。
+'''
+
+import http.client
+import math
+import random
+import threading
+import time
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+from weblog.metrics import metrics
+
+from .seed import email, PASSWORD
+
+
+class QuietHandler(WSGIRequestHandler):
+    '''使用 HTTP/1.1 以便客户端复用连接，不输出访问日志'''
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class Server:
+    '''在后台线程中运行的 WSGI 服务器，每个请求一个线程'''
+
+    def __init__(self, app, host='127.0.0.1', port=0):
+        self.server = make_server(host, port, app, threaded=True,
+                request_handler=QuietHandler)
+        self.host = host
+        self.port = self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.thread.join()
+
+
+class Client:
+    '''保持连接和 Cookie 的简单 HTTP 客户端，不跟随重定向'''
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.cookies = {}
+        self.conn = None
+
+    def request(self, method, path, form=None):
+        headers = {}
+        body = None
+        if self.cookies:
+            headers['Cookie'] = '; '.join('{}={}'.format(k, v)
+                    for k, v in self.cookies.items())
+        if form is not None:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        for retry in (True, False):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port,
+                        timeout=30)
+            try:
+                self.conn.request(method, path, body, headers)
+                response = self.conn.getresponse()
+                response.read()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                # 服务器关闭了空闲的连接，重新连接一次
+                self.close()
+                if not retry:
+                    raise
+        for header in response.headers.get_all('Set-Cookie') or []:
+            for name, morsel in SimpleCookie(header).items():
+                self.cookies[name] = morsel.value
+        return response.status
+
+    def login(self, user_id):
+        return self.request('POST', '/login', {'email': email(user_id),
+                'password': PASSWORD})
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def percentile(values, p):
+    '''values 已经排好序，返回第 p 百分位数（最近秩法）'''
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def scenarios(scale, rng):
+    '''
+    返回 [(endpoint, 权重, 请求函数)]
+    请求函数的参数为 Client ，返回 HTTP 状态码
+    '''
+
+    users = scale['users']
+    blogs = scale['blogs']
+
+    def user_name():
+        return 'user{}'.format(rng.randint(1, users))
+
+    def login(c):
+        # 每次登录使用新的客户端，测量完整的登录过程，结束后关闭连接
+        fresh = Client(c.host, c.port)
+        try:
+            return fresh.login(rng.randint(1, users))
+        finally:
+            fresh.close()
+
+    return [
+        ('front.index', 4, lambda c: c.request('GET', '/')),
+        ('front.blog', 4, lambda c: c.request('GET',
+                '/blog/{}'.format(rng.randint(1, blogs)))),
+        ('front.hot', 1, lambda c: c.request('GET', '/hot')),
+        ('user.index', 2, lambda c: c.request('GET',
+                '/user/{}/index'.format(user_name()))),
+        ('user.followers', 2, lambda c: c.request('GET',
+                '/user/{}/followers'.format(user_name()))),
+        ('front.login', 1, login),
+    ]
+
+
+def run(app, scale, requests=2000, concurrency=8, anonymous=False,
+        warmup=50, seed=0):
+    '''
+    在本进程中启动服务器，发起 requests 个请求，返回每个 endpoint 的统计结果
+    anonymous 为 False 时，每个客户端线程先登录为一个随机用户
+    '''
+
+    with Server(app) as server:
+        return drive(server.host, server.port, scale, requests, concurrency,
+                anonymous, warmup, seed)
+
+
+def drive(host, port, scale, requests=2000, concurrency=8, anonymous=False,
+        warmup=50, seed=0):
+    '''
+    向 host:port 上运行的服务器发起请求，返回每个 endpoint 的统计结果，
+    服务器在其他进程中时 SQL 次数为 0
+    '''
+
+    rng = random.Random(seed)
+    plan = scenarios(scale, rng)
+    names = [name for name, weight, func in plan]
+    weights = [weight for name, weight, func in plan]
+    funcs = {name: func for name, weight, func in plan}
+    sequence = rng.choices(names, weights, k=requests)
+    samples = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    lock = threading.Lock()
+    position = iter(range(requests))
+
+    clients = []
+    for i in range(concurrency):
+        client = Client(host, port)
+        if not anonymous:
+            client.login(rng.randint(1, scale['users']))
+        clients.append(client)
+    for i in range(warmup):
+        funcs[sequence[i % requests]](clients[0])
+    before = metrics.sql_count.totals()
+
+    def worker(client):
+        while True:
+            with lock:
+                i = next(position, None)
+            if i is None:
+                break
+            name = sequence[i]
+            start = time.perf_counter()
+            try:
+                status = funcs[name](client)
+            except (OSError, http.client.HTTPException):
+                status = None
+            elapsed = time.perf_counter() - start
+            with lock:
+                samples[name].append(elapsed)
+                if status is None or status >= 400:
+                    errors[name] += 1
+
+    threads = [threading.Thread(target=worker, args=(c,))
+            for c in clients]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - started
+    after = metrics.sql_count.totals()
+    for client in clients:
+        client.close()
+
+    results = {}
+    for name in names:
+        values = sorted(samples[name])
+        total, count = after.get(name, (0, 0))
+        old_total, old_count = before.get(name, (0, 0))
+        served = count - old_count
+        results[name] = {
+            'requests': len(values),
+            'errors': errors[name],
+            'throughput': round(len(values) / duration, 2),
+            'mean_ms': round(sum(values) / len(values) * 1000, 2)
+                    if values else 0.0,
+            'p50_ms': round(percentile(values, 50) * 1000, 2),
+            'p95_ms': round(percentile(values, 95) * 1000, 2),
+            'p99_ms': round(percentile(values, 99) * 1000, 2),
+            'queries': round((total - old_total) / served, 2)
+                    if served else 0.0,
+        }
+    return {'duration': round(duration, 3),
+            'throughput': round(requests / duration, 2),
+            'endpoints': results}
@@ -0,0 +1,109 @@
+'''
+批量生成压力测试使用的数据
+
+用户、关注关系、博客和评论都用 INSERT 语句批量写入，不经过 ORM ，
+所以写入之后要重新计算冗余的计数、重建动态表和搜索索引。
+同一个随机数种子生成的数据完全相同，不同次的测试结果可以互相比较。
+'''
+
+import random
+from datetime import datetime, timedelta
+
+from weblog import feed, graph, stats, search, comments, hot
+from weblog.markup import render
+from weblog.passwords import hasher
+from weblog.avatars import email_hash
+from weblog.models import db, Role, User, Follow, Blog, Comment
+
+# 每条 INSERT 语句写入的行数
+CHUNK_SIZE = 1000
+# 所有测试用户的密码
+PASSWORD = 'password'
+
+WORDS = ('flask', 'python', 'sqlalchemy', 'cache', 'index', 'query', 'blog',
+         'latency', 'follow', 'comment', 'template', 'markdown', '博客',
+         '数据库', '缓存', '索引', '性能', '关注', '评论', '模板')
+
+
+def _insert(table, rows):
+    for i in range(0, len(rows), CHUNK_SIZE):
+        db.session.execute(table.insert(), rows[i:i + CHUNK_SIZE])
+
+
+def _text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def _markdown(rng):
+    paragraphs = ['{} **{}** {}'.format(_text(rng, 12), rng.choice(WORDS),
+            _text(rng, 12)) for _ in range(rng.randint(1, 4))]
+    return '# {}\n\n{}'.format(_text(rng, 4), '\n\n'.join(paragraphs))
+
+
+def email(i):
+    return 'user{}@example.com'.format(i)
+
+
+def seed(users=200, follows=20, blogs=5, comments_per_blog=3, days=30,
+        seed=0):
+    '''
+    生成 users 个用户，每个用户关注 follows 个其他用户、发布 blogs 篇博客，
+    每篇博客有 comments_per_blog 条评论，时间分布在最近 days 天内
+    返回各数据表写入的行数
+    '''
+
+    rng = random.Random(seed)
+    now = datetime.now()
+    span = days * 24 * 3600
+
+    def moment():
+        return now - timedelta(seconds=rng.randint(0, span))
+
+    db.create_all()
+    Role.insert_roles()
+    role_id = Role.query.filter_by(default=True).first().id
+    # 计算密码哈希很慢，所有用户共用同一个哈希
+    password = hasher.hash(PASSWORD)
+
+    user_rows = [{
+        'id': i, 'name': 'user{}'.format(i), 'email': email(i),
+        'password': password, 'role_id': role_id,
+        'about_me': _text(rng, 8), 'created_at': moment(), 'last_seen': now,
+        'feed_pull': False, 'avatar_hash': email_hash(email(i)),
+    } for i in range(1, users + 1)]
+    _insert(User.__table__, user_rows)
+
+    follow_rows = []
+    for i in range(1, users + 1):
+        others = rng.sample(range(1, users + 1), min(follows + 1, users))
+        follow_rows.extend({'follower_id': i, 'followed_id': j,
+                'time_stamp': moment()} for j in others if j != i)
+    _insert(Follow.__table__, follow_rows)
+
+    blog_rows = []
+    for blog_id in range(1, users * blogs + 1):
+        body = _markdown(rng)
+        time_stamp = moment()
+        blog_rows.append({
+            'id': blog_id, 'body': body, 'body_html': render(body),
+            'time_stamp': time_stamp, 'updated_at': time_stamp,
+            'comment_count': 0, 'author_id': rng.randint(1, users),
+        })
+    _insert(Blog.__table__, blog_rows)
+
+    comment_rows = [{
+        'body': _text(rng, 10), 'time_stamp': moment(), 'disable': False,
+        'author_id': rng.randint(1, users), 'blog_id': blog_id,
+    } for blog_id in range(1, len(blog_rows) + 1)
+      for _ in range(comments_per_blog)]
+    _insert(Comment.__table__, comment_rows)
+    db.session.commit()
+
+    graph.recount()
+    stats.reconcile()
+    comments.recount()
+    hot.rebuild()
+    feed.rebuild()
+    search.reindex()
+    return {'users': len(user_rows), 'follows': len(follow_rows),
+            'blogs': len(blog_rows), 'comments': len(comment_rows)}
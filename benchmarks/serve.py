@@ -0,0 +1,40 @@
+'''
+在单独的进程中启动待测的服务器，由 concurrency.py 调用：
+
+    python -m benchmarks.serve threaded|gevent
+
+数据库由环境变量 TEST_DATABASE_URL 指定，启动后在标准输出打印监听的端口，
+之后一直运行，直到被父进程结束。
+'''
+
+import sys
+
+# gevent 的补丁必须在导入其他模块之前执行
+if __name__ == '__main__' and sys.argv[1:2] == ['gevent']:
+    from gevent import monkey
+    monkey.patch_all()
+
+import os
+
+
+def main(mode):
+    if mode == 'gevent':
+        os.environ['WEBLOG_CONCURRENCY'] = 'gevent'
+    from weblog.app import create_app
+
+    app = create_app('test')
+    if mode == 'gevent':
+        from weblog.cooperative import make_server
+        server = make_server(app, port=0)
+        server.start()
+        port = server.server_port
+    else:
+        from .load import Server
+        server = Server(app).server
+        port = server.server_port
+    print(port, flush=True)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1])
@@ -0,0 +1,16 @@
+# 必须在导入其他模块之前打补丁，socket 和 threading 等才会替换为协作式的版本
+from gevent import monkey
+monkey.patch_all()
+
+import os
+
+from weblog.app import create_app
+from weblog.cooperative import make_server
+
+# 默认使用 gevent 配置，数据库地址等与 prod 相同，从环境变量中读取
+app = create_app(os.environ.get('WEBLOG_CONFIG') or 'gevent')
+
+if __name__ == '__main__':
+    server = make_server(app, os.environ.get('HOST', '127.0.0.1'),
+            int(os.environ.get('PORT', 5000)))
+    server.serve_forever()
@@ -1,6 +1,9 @@
+import os
+
 from weblog.app import create_app
 
-app = create_app('dev')
+# 通过环境变量 WEBLOG_CONFIG 选择配置，可选 dev 、test 和 prod
+app = create_app(os.environ.get('WEBLOG_CONFIG') or 'dev')
 
 if __name__ == '__main__':
     app.run()
\ No newline at end of file
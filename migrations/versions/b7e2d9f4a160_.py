@@ -0,0 +1,39 @@
+"""fill in user.avatar_hash from the email address
+
+Revision ID: b7e2d9f4a160
+Revises: f3c8a0d6b157
+Create Date: 2026-10-18 18:02:47.215390
+
+"""
+import hashlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e2d9f4a160'
+down_revision = 'f3c8a0d6b157'
+branch_labels = None
+depends_on = None
+
+user = sa.table('user',
+    sa.column('id', sa.Integer),
+    sa.column('email', sa.String),
+    sa.column('avatar_hash', sa.String),
+)
+
+
+def upgrade():
+    # 与 weblog.avatars.email_hash 相同，迁移中不导入应用的代码
+    conn = op.get_bind()
+    rows = conn.execute(sa.select([user.c.id, user.c.email]).where(
+            sa.and_(user.c.avatar_hash == None, user.c.email != None))).fetchall()
+    for user_id, email in rows:
+        conn.execute(user.update().where(user.c.id == user_id).values(
+                avatar_hash=hashlib.md5(
+                    email.strip().lower().encode('utf-8')).hexdigest()))
+
+
+def downgrade():
+    op.execute(user.update().values(avatar_hash=None))
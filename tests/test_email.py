@@ -0,0 +1,185 @@
+'''
+邮件队列的测试
+
+在本进程中启动一个只实现必要命令的 SMTP 服务器代替真实的邮件服务器，
+可以让它拒绝前几个连接或者暂停在问候语之前，模拟发送失败和发送缓慢。
+'''
+
+import socketserver
+import threading
+import time
+import unittest
+
+from flask_mail import Message
+
+from weblog.app import create_app
+from weblog.email import mail, MailQueue
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    '''记录每封邮件来自第几个连接的 SMTP 服务器'''
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, refuse=0):
+        super().__init__(('127.0.0.1', 0), SMTPHandler)
+        self.refuse = refuse            # 拒绝前几个连接
+        self.connections = 0
+        self.messages = []              # [(连接序号, 邮件内容)]
+        self.open = threading.Event()   # 清除后新的连接暂停在问候语之前
+        self.open.set()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def stop(self):
+        self.open.set()
+        self.shutdown()
+        self.server_close()
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+            number = server.connections
+        server.open.wait()
+        if number <= server.refuse:
+            self.reply('421 busy')
+            return
+        self.reply('220 stand-in')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command == b'DATA':
+                self.reply('354 go ahead')
+                lines = []
+                for data in iter(self.rfile.readline, b''):
+                    if data == b'.\r\n':
+                        break
+                    lines.append(data)
+                with server.lock:
+                    server.messages.append((number, b''.join(lines)))
+                self.reply('250 queued')
+            elif command == b'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 ok')
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('等待超时')
+        time.sleep(0.01)
+
+
+class MailTestCase(unittest.TestCase):
+    '''启动 SMTP 服务器和使用它的邮件队列'''
+
+    refuse = 0
+
+    def setUp(self):
+        self.smtp = SMTPStandIn(self.refuse)
+        self.app = create_app('test')
+        self.app.config.update(
+            MAIL_SERVER='127.0.0.1',
+            MAIL_PORT=self.smtp.port,
+            MAIL_USE_TLS=False,
+            MAIL_USE_SSL=False,
+            MAIL_USERNAME=None,
+            MAIL_PASSWORD=None,
+            MAIL_SUPPRESS_SEND=False,
+            MAIL_WORKERS=1,
+            MAIL_RETRY_BACKOFF=0.01,
+            MAIL_QUEUE_TIMEOUT=0.05,
+        )
+        # 重新读取上面的邮件服务器配置
+        mail.init_app(self.app)
+        self.queue = MailQueue()
+        self.queue.init_app(self.app)
+
+    def tearDown(self):
+        self.queue.shutdown(timeout=5)
+        self.smtp.stop()
+
+    def message(self, subject='hello'):
+        return Message(subject, sender='weblog@example.com',
+                recipients=['user@example.com'], body='body')
+
+
+class MailQueueTestCase(MailTestCase):
+
+    def test_messages_share_one_connection(self):
+        # 第一封邮件连接时暂停，后面的邮件在队列中排队
+        self.smtp.open.clear()
+        for i in range(5):
+            self.assertTrue(self.queue.put(self.message()))
+        wait_for(lambda: self.smtp.connections == 1)
+        self.smtp.open.set()
+        wait_for(lambda: self.queue.stats()['sent'] == 5)
+        self.assertEqual(self.smtp.connections, 1)
+        self.assertEqual([n for n, _ in self.smtp.messages], [1] * 5)
+
+    def test_bad_message_does_not_stop_worker(self):
+        self.queue.put(self.message('bad\nheader'))
+        self.queue.put(self.message())
+        wait_for(lambda: self.queue.stats()['sent'] == 1)
+        stats = self.queue.stats()
+        self.assertEqual(stats['failed'], 1)
+        self.assertEqual(stats['workers'], 1)
+        self.assertTrue(all(t.is_alive() for t in self.queue._threads))
+
+    def test_dropped_when_full(self):
+        self.app.config['MAIL_QUEUE_SIZE'] = 1
+        self.queue.init_app(self.app)
+        self.smtp.open.clear()
+        # 工作线程取出第一封之后卡在连接上，第二封占满队列，第三封被丢弃
+        self.assertTrue(self.queue.put(self.message()))
+        wait_for(lambda: self.smtp.connections == 1)
+        self.assertTrue(self.queue.put(self.message()))
+        self.assertFalse(self.queue.put(self.message()))
+        self.assertEqual(self.queue.stats()['dropped'], 1)
+        self.smtp.open.set()
+        wait_for(lambda: self.queue.stats()['sent'] == 2)
+
+
+class MailRetryTestCase(MailTestCase):
+
+    # 前两个连接被拒绝，第三次连接成功
+    refuse = 2
+
+    def test_retry_with_backoff(self):
+        self.queue.put(self.message())
+        wait_for(lambda: self.queue.stats()['sent'] == 1)
+        stats = self.queue.stats()
+        self.assertEqual(stats['retried'], 2)
+        self.assertEqual(stats['failed'], 0)
+        self.assertEqual(self.smtp.connections, 3)
+
+    def test_failed_after_retries(self):
+        self.smtp.refuse = 100
+        self.queue.put(self.message())
+        wait_for(lambda: self.queue.stats()['failed'] == 1)
+        stats = self.queue.stats()
+        self.assertEqual(stats['retried'],
+                self.app.config['MAIL_MAX_RETRIES'])
+        self.assertEqual(stats['sent'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+'''
+读写分离的测试
+
+用两个 SQLite 文件代替主库和副本：先在主库中写入数据，复制一份作为副本，
+之后只写入主库的数据就相当于副本还没有同步到的数据。
+'''
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from weblog.app import create_app
+from weblog.models import db, Role, User, Follow
+from weblog import identity
+from weblog.graph import graph
+from weblog.presence import tracker
+
+
+class RoutingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        primary = os.path.join(self.directory, 'primary.db')
+        replica = os.path.join(self.directory, 'replica.db')
+        self.app = create_app('test')
+        self.app.config.update(
+            SQLALCHEMY_DATABASE_URI='sqlite:///' + primary,
+            SQLALCHEMY_BINDS={'replica1': 'sqlite:///' + replica},
+            SQLALCHEMY_REPLICAS=['replica1'],
+            REPLICA_STICKY_SECONDS=0.2,
+            CACHE_PAGES=False,
+        )
+        self.app.add_url_rule('/_test/names', 'test_names', self.names,
+                methods=['GET', 'POST'])
+        self.app.add_url_rule('/_test/write', 'test_write', self.write,
+                methods=['GET', 'POST'])
+        identity.cache.clear()
+        graph.clear()
+        with self.app.app_context():
+            db.create_all()
+            Role.insert_roles()
+            alice = User(name='alice', email='a@x.com', password='pw1')
+            bob = User(name='bob', email='b@x.com', password='pw2')
+            db.session.add_all([alice, bob])
+            db.session.commit()
+            self.alice_id, self.bob_id = alice.id, bob.id
+            db.session.remove()
+            db.get_engine(self.app).dispose()
+            shutil.copy(primary, replica)
+            # 下面的数据只在主库中
+            db.session.add(User(name='carol', email='c@x.com', password='pw3'))
+            db.session.add(Follow(follower_id=self.alice_id,
+                    followed_id=self.bob_id))
+            db.session.commit()
+            db.session.remove()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        # 登录时记录的活跃时间要在删除数据库之前写入，否则进程退出时才写入
+        tracker.flush()
+        with self.app.app_context():
+            db.session.remove()
+            db.get_engine(self.app).dispose()
+            db.get_engine(self.app, bind='replica1').dispose()
+        shutil.rmtree(self.directory)
+
+    @staticmethod
+    def names():
+        return ','.join(sorted(name for name, in db.session.query(User.name)))
+
+    @staticmethod
+    def write():
+        db.session.add(User(name='dave', email='d@x.com', password='pw4'))
+        db.session.commit()
+        # 同一个会话写入之后的查询读取主库
+        return RoutingTestCase.names()
+
+    def replica_names(self):
+        with self.app.app_context():
+            engine = db.get_engine(self.app, bind='replica1')
+            return sorted(name for name, in engine.execute(
+                    'SELECT name FROM user'))
+
+    def test_get_reads_replica(self):
+        self.assertEqual(self.client.get('/_test/names').data, b'alice,bob')
+
+    def test_post_reads_primary(self):
+        self.assertEqual(self.client.post('/_test/names').data,
+                b'alice,bob,carol')
+
+    def test_writes_go_to_primary(self):
+        response = self.client.get('/_test/write')
+        self.assertEqual(response.data, b'alice,bob,carol,dave')
+        self.assertEqual(self.replica_names(), ['alice', 'bob'])
+
+    def test_reads_stick_to_primary_after_write(self):
+        self.client.post('/_test/write')
+        self.assertEqual(self.client.get('/_test/names').data,
+                b'alice,bob,carol,dave')
+        time.sleep(0.25)
+        self.assertEqual(self.client.get('/_test/names').data, b'alice,bob')
+
+    def test_primary_only_view(self):
+        # 副本中还没有 alice 对 bob 的关注，取关之前的判断必须读取主库
+        self.client.post('/login', data={'email': 'a@x.com',
+                'password': 'pw1'})
+        time.sleep(0.25)
+        self.client.get('/user/unfollow/bob')
+        with self.app.app_context():
+            self.assertIsNone(Follow.query.get((self.alice_id, self.bob_id)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,38 +1,113 @@
+import os
+
 from flask import Flask
 from .handles import blueprint_list
-from flask_bootstrap import Bootstrap
+from .commands import command_list
 from .configs import configs
 from .models import db, Role, User
-from flask_moment import Moment
-from flask_migrate import Migrate
-from flask_login import LoginManager
-from flask_pagedown import PageDown
+from . import markup, identity, startup
+from .presence import tracker
+from .email import mail, mail_queue
+from .graph import graph
+from .cache import page_cache
+from .metrics import metrics
+from .passwords import hasher
+from .assets import assets
+from .avatars import store as avatar_store
+from .hot import ranking
 
 def register_blueprints(app):
     for bp in blueprint_list:
         app.register_blueprint(bp)
 
+def register_commands(app):
+    for command in command_list:
+        app.cli.add_command(command)
+
 def register_extensions(app):
-    Bootstrap(app)
-    db.init_app(app)
-    Moment(app)
-    Migrate(app, db)
-    PageDown().init_app(app)
-    login_manager = LoginManager()
-    login_manager.init_app(app)
+    # 第三方扩展在各自的步骤中导入，启动报告中的耗时包含导入的时间
+    step = app.extensions['startup'].step
+    with step('flask_bootstrap'):
+        from flask_bootstrap import Bootstrap
+        Bootstrap(app)
+    with step('flask_sqlalchemy'):
+        db.init_app(app)
+    with step('flask_moment'):
+        from flask_moment import Moment
+        Moment(app)
+    # 只有 flask 命令行（flask db 等）才需要 Flask-Migrate ，
+    # gunicorn 等启动的进程不导入 Alembic
+    if os.environ.get('FLASK_RUN_FROM_CLI'):
+        with step('flask_migrate'):
+            from flask_migrate import Migrate
+            Migrate(app, db)
+    with step('flask_pagedown'):
+        from flask_pagedown import PageDown
+        PageDown().init_app(app)
+    with step('assets'):
+        # 要在 Flask-Bootstrap 和 Flask-PageDown 之后初始化
+        assets.init_app(app)
+    with step('markup'):
+        markup.init_app(app)
+    with step('identity'):
+        identity.init_app(app)
+    with step('passwords'):
+        hasher.init_app(app)
+    with step('avatars'):
+        avatar_store.init_app(app)
+    with step('presence'):
+        tracker.init_app(app)
+    with step('flask_mail'):
+        mail.init_app(app)
+        mail_queue.init_app(app)
+    with step('graph'):
+        graph.init_app(app)
+    with step('hot'):
+        ranking.init_app(app)
+    with step('cache'):
+        page_cache.init_app(app)
+    with step('metrics'):
+        metrics.init_app(app)
+        metrics.register('weblog_mail', mail_queue.stats,
+                counters=('sent', 'failed', 'retried', 'dropped'))
+    with step('flask_login'):
+        from flask_login import LoginManager
+        login_manager = LoginManager()
+        login_manager.init_app(app)
     @login_manager.user_loader
     def user_loader(id):
-        return User.query.get(id)
+        # 先从进程内的缓存中获取用户，缓存过期后才查询数据库
+        return identity.load_user(id)
     login_manager.login_view = 'front.login'
     login_manager.login_message = '你需要登录之后才能访问页面'
     login_manager.login_message_category = 'warning'
 
+def register_templates(app):
+    step = app.extensions['startup'].step
+    with step('jinja_bytecode_cache'):
+        startup.init_bytecode_cache(app)
+    if app.config['TEMPLATE_WARMUP']:
+        with step('template_warmup'):
+            startup.warm_up(app)
+
 
 def create_app(config):
     app = Flask(__name__)
+    timer = startup.StartupTimer()
+    app.extensions['startup'] = timer
 
-    app.config.from_object(configs.get(config))
+    with timer.step('config'):
+        app.config.from_object(configs.get(config))
+    if app.config['CONCURRENCY'] == 'gevent':
+        with timer.step('gevent'):
+            from . import cooperative
+            cooperative.init_app(app)
     register_extensions(app)
-    register_blueprints(app)
-    app.debug = True
-    return app
\ No newline at end of file
+    with timer.step('blueprints'):
+        register_blueprints(app)
+    with timer.step('commands'):
+        register_commands(app)
+    register_templates(app)
+    if app.config['STARTUP_REPORT']:
+        app.logger.info('启动耗时：\n' + '\n'.join(timer.report()))
+    return app
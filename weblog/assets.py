@@ -0,0 +1,308 @@
+'''
+静态文件的发布
+
+flask assets build 把静态文件复制到 static/dist 目录，文件名中加入内容的哈希值，
+例如 main.css 变为 dist/main.3f2a9c1d0b7e.css ，同时写入 manifest.json 记录对应关系：
+
+- url_for('static', filename='main.css') 按 manifest 生成带哈希值的地址，
+  内容变化后地址也随之变化，所以这些文件可以让浏览器和 CDN 永久缓存
+- 文本类型的文件预先压缩出 .gz 和 .br （需要安装 brotli）两个版本，
+  请求时按 Accept-Encoding 直接发送压缩好的文件，不在请求中压缩
+- Flask-Bootstrap 自带的 Bootstrap 和 jQuery 文件也一起发布；
+  flask assets fetch 把 Moment.js 和 PageDown 下载到 static/vendor 。
+  打开 ASSETS_SERVE_LOCAL 之后这些文件都从本站提供，不再使用公共 CDN
+- 样式表中 url() 引用的字体、图片和脚本末尾的 sourceMappingURL 会改写为带哈希值的地址
+
+没有执行过 build 或者关闭 ASSETS_USE_MANIFEST 时，静态文件按原来的方式提供。
+'''
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+
+from flask import current_app, request, send_from_directory, url_for
+from markupsafe import Markup
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 发布目录，位于 static 目录下
+DIST_DIR = 'dist'
+MANIFEST = 'manifest.json'
+# 预先压缩的文件类型，字体中的 woff/woff2 和图片本身已经压缩过
+COMPRESSIBLE = {'.css', '.js', '.map', '.json', '.svg', '.ico', '.txt',
+                '.html', '.xml', '.eot', '.ttf'}
+# 压缩文件的扩展名
+SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+# flask assets fetch 下载的第三方文件，键为 static 目录下的文件名
+VENDOR_FILES = {
+    'vendor/moment-with-locales.min.js':
+        'https://cdnjs.cloudflare.com/ajax/libs/moment.js/{moment}/'
+        'moment-with-locales.min.js',
+    'vendor/Markdown.Converter.min.js':
+        'https://cdnjs.cloudflare.com/ajax/libs/pagedown/1.0/'
+        'Markdown.Converter.min.js',
+    'vendor/Markdown.Sanitizer.min.js':
+        'https://cdnjs.cloudflare.com/ajax/libs/pagedown/1.0/'
+        'Markdown.Sanitizer.min.js',
+}
+PAGEDOWN_FILES = ['vendor/Markdown.Converter.min.js',
+                  'vendor/Markdown.Sanitizer.min.js']
+MOMENT_FILE = 'vendor/moment-with-locales.min.js'
+
+# 样式表中的 url(...) 和脚本、样式表末尾的 sourceMappingURL=...
+_CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+_SOURCE_MAP = re.compile(r'(sourceMappingURL=)(\S+?)(\s*\*/|\s*$)', re.M)
+
+
+def _sources(app):
+    '''要发布的文件，返回 {发布后的名称: 源文件路径}'''
+    sources = {}
+    roots = [('', app.static_folder)]
+    bootstrap = app.blueprints.get('bootstrap')
+    if bootstrap is not None and bootstrap.has_static_folder:
+        roots.append(('bootstrap/', bootstrap.static_folder))
+    dist = os.path.join(app.static_folder, DIST_DIR)
+    for prefix, root in roots:
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames
+                           if os.path.join(dirpath, d) != dist]
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                name = os.path.relpath(path, root).replace(os.sep, '/')
+                sources[prefix + name] = path
+    return sources
+
+
+def _hashed_name(name, data):
+    root, ext = posixpath.splitext(name)
+    return '{}.{}{}'.format(root, hashlib.md5(data).hexdigest()[:12], ext)
+
+
+def _rewrite(name, data, names):
+    '''把样式表和脚本中引用的其他文件改写为发布后的名称'''
+    text = data.decode('utf-8')
+    directory = posixpath.dirname(name)
+
+    def resolve(ref):
+        if re.match(r'^(data:|[a-z]+:|//|/|#)', ref):
+            return None
+        # 保留 ?#iefix 之类的后缀
+        path, rest = re.match(r'^([^?#]*)(.*)$', ref).groups()
+        target = posixpath.normpath(posixpath.join(directory, path))
+        if target not in names:
+            return None
+        # 发布目录的结构与源目录相同，相对路径从原来的目录算起
+        return posixpath.relpath(names[target], directory or '.') + rest
+
+    def css_url(match):
+        url = resolve(match.group(2))
+        if url is None:
+            return match.group(0)
+        return 'url({0}{1}{0})'.format(match.group(1), url)
+
+    def source_map(match):
+        url = resolve(match.group(2))
+        if url is None:
+            return match.group(0)
+        return match.group(1) + url + match.group(3)
+
+    if name.endswith('.css'):
+        text = _CSS_URL.sub(css_url, text)
+    return _SOURCE_MAP.sub(source_map, text).encode('utf-8')
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def _compress(path, data):
+    '''写入比原文件小的压缩版本，返回写入的编码列表'''
+    encodings = []
+    if brotli is not None:
+        compressed = brotli.compress(data, quality=11)
+        if len(compressed) < len(data):
+            _write(path + SUFFIXES['br'], compressed)
+            encodings.append('br')
+    # mtime=0 使同样的内容每次压缩的结果都相同
+    compressed = gzip.compress(data, 9, mtime=0)
+    if len(compressed) < len(data):
+        _write(path + SUFFIXES['gzip'], compressed)
+        encodings.append('gzip')
+    return encodings
+
+
+def build():
+    '''
+    发布静态文件，返回发布的文件数量。
+    旧版本的文件保留在发布目录中，已经打开的页面仍然可以加载到它们
+    '''
+    app = current_app._get_current_object()
+    sources = _sources(app)
+    contents = {}
+    for name, path in sources.items():
+        with open(path, 'rb') as f:
+            contents[name] = f.read()
+
+    # 样式表和脚本引用的文件要先确定名称，所以先处理不需要改写的文件
+    names = {}
+    rewritten = [name for name in contents
+                 if posixpath.splitext(name)[1] in ('.css', '.js')]
+    for name in contents:
+        if name not in rewritten:
+            names[name] = _hashed_name(name, contents[name])
+    for name in rewritten:
+        contents[name] = _rewrite(name, contents[name], names)
+        names[name] = _hashed_name(name, contents[name])
+
+    dist = os.path.join(app.static_folder, DIST_DIR)
+    manifest = {}
+    for name, data in contents.items():
+        path = os.path.join(dist, *names[name].split('/'))
+        _write(path, data)
+        encodings = []
+        if posixpath.splitext(name)[1] in COMPRESSIBLE:
+            encodings = _compress(path, data)
+        manifest[name] = {'file': DIST_DIR + '/' + names[name],
+                          'encodings': encodings}
+    with open(os.path.join(dist, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return len(manifest)
+
+
+def fetch():
+    '''下载 Moment.js 和 PageDown 的文件到 static/vendor ，返回下载的文件列表'''
+    import urllib.request
+    # 下载与 Flask-Moment 默认版本相同的 Moment.js
+    from flask_moment import default_moment_version
+    fetched = []
+    for name, url in VENDOR_FILES.items():
+        path = os.path.join(current_app.static_folder, *name.split('/'))
+        url = url.format(moment=default_moment_version)
+        with urllib.request.urlopen(url, timeout=30) as response:
+            _write(path, response.read())
+        fetched.append(name)
+    return fetched
+
+
+class AssetCDN:
+    '''
+    替换 Flask-Bootstrap 的 local CDN ：发布过的文件使用带哈希值的地址，
+    否则交给 Flask-Bootstrap 自带的 bootstrap.static
+    '''
+
+    def __init__(self, assets, prefix, fallback):
+        self.assets = assets
+        self.prefix = prefix
+        self.fallback = fallback
+
+    def get_resource_url(self, filename):
+        if self.prefix + filename in self.assets.files:
+            return url_for('static', filename=self.prefix + filename)
+        return self.fallback.get_resource_url(filename)
+
+
+class LocalPageDown:
+    '''ASSETS_SERVE_LOCAL 打开并且下载了 PageDown 时从本站加载它的脚本'''
+
+    def __init__(self, assets, pagedown):
+        self.assets = assets
+        self.pagedown = pagedown
+
+    def include_pagedown(self):
+        urls = [self.assets.local_url(name) for name in PAGEDOWN_FILES]
+        if not all(urls):
+            return self.pagedown.include_pagedown()
+        return Markup(''.join('<script type="text/javascript" src="{}">'
+                '</script>\n'.format(url) for url in urls))
+
+    def html_head(self):
+        return self.include_pagedown()
+
+
+class Assets:
+    '''读取 manifest ，生成带哈希值的地址，并提供预先压缩的文件'''
+
+    def __init__(self):
+        # 源文件名 -> 发布后的文件名
+        self.files = {}
+        # 发布后的文件名 -> 可用的压缩编码
+        self.encodings = {}
+
+    def init_app(self, app):
+        self.load(app)
+        if app.config['ASSETS_SERVE_LOCAL']:
+            app.config['BOOTSTRAP_SERVE_LOCAL'] = True
+        bootstrap = app.extensions.get('bootstrap')
+        if bootstrap is not None:
+            cdns = bootstrap['cdns']
+            for cdn in cdns.values():
+                if getattr(cdn, 'primary', None) is cdns['local']:
+                    cdn.primary = AssetCDN(self, 'bootstrap/', cdns['local'])
+        if 'pagedown' in app.extensions:
+            app.extensions['pagedown'] = LocalPageDown(self,
+                    app.extensions['pagedown'])
+        app.add_template_global(self.local_url, 'local_asset')
+        app.url_defaults(self.url_defaults)
+        send_static_file = app.view_functions['static']
+
+        def static(filename):
+            if filename in self.encodings:
+                return self.send(app, filename)
+            return send_static_file(filename=filename)
+
+        app.view_functions['static'] = static
+
+    def load(self, app):
+        self.files.clear()
+        self.encodings.clear()
+        path = os.path.join(app.static_folder, DIST_DIR, MANIFEST)
+        if not app.config['ASSETS_USE_MANIFEST'] or not os.path.exists(path):
+            return
+        with open(path) as f:
+            manifest = json.load(f)
+        for name, entry in manifest.items():
+            self.files[name] = entry['file']
+            self.encodings[entry['file']] = entry['encodings']
+
+    def url_defaults(self, endpoint, values):
+        if endpoint == 'static' and values.get('filename') in self.files:
+            values['filename'] = self.files[values['filename']]
+
+    def local_url(self, filename):
+        '''ASSETS_SERVE_LOCAL 打开并且文件存在时返回它的地址，否则返回 None'''
+        if not current_app.config['ASSETS_SERVE_LOCAL']:
+            return None
+        if filename not in self.files and not os.path.exists(os.path.join(
+                current_app.static_folder, *filename.split('/'))):
+            return None
+        return url_for('static', filename=filename)
+
+    def send(self, app, filename):
+        '''发送发布目录中的文件，客户端支持时发送压缩好的版本'''
+        encoding = request.accept_encodings.best_match(
+                self.encodings[filename])
+        mimetype = mimetypes.guess_type(filename)[0] or \
+                'application/octet-stream'
+        response = send_from_directory(app.static_folder,
+                filename + SUFFIXES.get(encoding, ''), mimetype=mimetype)
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        if self.encodings[filename]:
+            response.vary.add('Accept-Encoding')
+        # 内容变化时文件名也会变化，浏览器在有效期内不需要再验证
+        response.headers['Cache-Control'] = 'public, max-age={}, immutable' \
+                .format(app.config['ASSETS_MAX_AGE'])
+        return response
+
+
+assets = Assets()
@@ -0,0 +1,126 @@
+'''
+检查视图中的查询是否用到了索引
+
+用测试客户端访问各个页面，记录期间执行的所有 SELECT 语句和参数，
+再对每条语句执行 EXPLAIN（SQLite 为 EXPLAIN QUERY PLAN），
+找出全表扫描和不能利用索引排序的查询。
+访问页面时关闭页面缓存，并分别以未登录和登录用户的身份访问。
+数据量很小时数据库可能选择全表扫描，最好在接近线上规模的数据上检查。
+'''
+
+import re
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .models import db, User, Blog
+from .pagination import encode_cursor
+
+# SQLite 中不使用索引的扫描，例如 SCAN blog 或旧版本的 SCAN TABLE blog
+_SQLITE_SCAN = re.compile(r'^SCAN (TABLE )?\w+$')
+
+
+@contextmanager
+def capture():
+    '''记录代码块中执行的 SELECT 语句，返回 [(Engine, 语句, 参数)]'''
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(
+                'SELECT'):
+            statements.append((conn.engine, statement, parameters))
+
+    event.listen(Engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(Engine, 'before_cursor_execute', record)
+
+
+def explain(engine, statement, parameters):
+    '''返回 (执行计划的每一行, 发现的问题列表)'''
+    dialect = engine.dialect.name
+    prefix = 'EXPLAIN QUERY PLAN ' if dialect == 'sqlite' else 'EXPLAIN '
+    with engine.connect() as conn:
+        result = conn.execute(prefix + statement, parameters)
+        keys = list(result.keys())
+        rows = [dict(zip(keys, row)) for row in result]
+    problems = []
+    if dialect == 'sqlite':
+        lines = [row['detail'] for row in rows]
+        for line in lines:
+            if _SQLITE_SCAN.match(line):
+                problems.append('全表扫描：' + line)
+            elif 'TEMP B-TREE' in line:
+                problems.append('没有使用索引排序：' + line)
+    elif dialect == 'mysql':
+        lines = ['{table}: type={type} key={key} rows={rows} {Extra}'.format(
+                **{k: row.get(k) for k in ('table', 'type', 'key', 'rows',
+                'Extra')}) for row in rows]
+        for row, line in zip(rows, lines):
+            if row.get('type') == 'ALL':
+                problems.append('全表扫描：' + line)
+            elif 'filesort' in (row.get('Extra') or ''):
+                problems.append('没有使用索引排序：' + line)
+    else:
+        lines = [' '.join(str(v) for v in row.values()) for row in rows]
+        problems = ['全表扫描：' + line for line in lines if 'Seq Scan' in line]
+    return lines, problems
+
+
+def _sample_paths():
+    '''根据数据库中已有的数据生成要访问的页面'''
+    paths = ['/', '/search?q=flask']
+    blog = Blog.query.order_by(Blog.comment_count.desc()).first()
+    if blog is not None:
+        paths.append('/?cursor=' + encode_cursor(blog.time_stamp, blog.id))
+        paths.append('/blog/{}'.format(blog.id))
+    user = User.query.order_by(User.follower_count.desc()).first()
+    if user is not None:
+        for page in ('index', 'followers', 'followed'):
+            paths.append('/user/{}/{}'.format(user.name, page))
+    return paths, user
+
+
+def audit(app, paths=None):
+    '''
+    访问页面并检查执行过的查询，返回
+    [(页面, 语句, 执行计划, 问题列表)] ，相同的语句只检查一次
+    '''
+
+    with app.app_context():
+        sample_paths, user = _sample_paths()
+        user_id = user.id if user is not None else None
+        db.session.remove()
+    paths = paths or sample_paths
+    client = app.test_client()
+    cache_pages = app.config['CACHE_PAGES']
+    app.config['CACHE_PAGES'] = False
+    visits = []
+    try:
+        for logged_in in (False, True):
+            if logged_in:
+                if user_id is None:
+                    break
+                with client.session_transaction() as session:
+                    session['_user_id'] = str(user_id)
+                    session['_fresh'] = True
+            for path in paths:
+                with capture() as statements:
+                    client.get(path)
+                label = '{} ({})'.format(path, '登录' if logged_in else '未登录')
+                visits.append((label, statements))
+    finally:
+        app.config['CACHE_PAGES'] = cache_pages
+
+    seen = set()
+    report = []
+    for label, statements in visits:
+        for engine, statement, parameters in statements:
+            if statement in seen:
+                continue
+            seen.add(statement)
+            lines, problems = explain(engine, statement, parameters)
+            report.append((label, statement, lines, problems))
+    return report
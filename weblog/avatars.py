@@ -0,0 +1,263 @@
+'''
+用户头像
+
+- 设置邮箱时根据邮箱计算一次 avatar_hash ，默认头像是由它生成的 identicon
+- 用户上传的图片由 Pillow （可选依赖，没有安装时不能上传）裁剪缩放，
+  avatar_hash 改为上传内容的哈希值，之后修改邮箱不再影响头像
+- 生成和缩放图片都在进程池中执行，每种尺寸保存为
+  AVATAR_DIR/<哈希前两位>/<哈希>/<尺寸>.png ，同一个哈希对应的文件永远不变，
+  所以以 immutable 的缓存头提供
+- 模板中用 avatar_url(user, size) 生成地址，只用到已经加载的 avatar_hash ，
+  不查询数据库，渲染页面时也不生成图片；
+  avatar_hash 变化的事务提交之后，在后台生成各种尺寸的 identicon
+'''
+
+import colorsys
+import hashlib
+import importlib.util
+import io
+import os
+import struct
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import url_for
+
+from .models import db, User
+
+# 邮箱的哈希为 32 位，上传图片的哈希为 40 位，只有前者可以随时重新生成
+IDENTICON_HASH_LENGTH = 32
+# identicon 的格子数，左右对称
+GRID = 5
+BACKGROUND = (240, 240, 240)
+
+
+def email_hash(email):
+    return hashlib.md5(email.strip().lower().encode('utf-8')).hexdigest()
+
+
+def _png(width, height, rows):
+    '''把 RGB 像素行编码为 PNG'''
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack(
+                '>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    raw = b''.join(b'\x00' + row for row in rows)
+    return b''.join([
+        b'\x89PNG\r\n\x1a\n',
+        chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)),
+        chunk(b'IDAT', zlib.compress(raw, 9)),
+        chunk(b'IEND', b''),
+    ])
+
+
+def identicon(digest, size):
+    '''5x5 的对称图案，颜色和图案都由哈希值决定，返回 PNG'''
+    data = bytes.fromhex(digest)
+    r, g, b = colorsys.hls_to_rgb(data[0] / 255, 0.5, 0.55 + data[1] / 1024)
+    color = bytes([int(r * 255), int(g * 255), int(b * 255)])
+    background = bytes(BACKGROUND)
+    bits = int.from_bytes(data[2:6], 'big')
+    cell = size // (GRID + 1)
+    margin = (size - cell * GRID) // 2
+    blank = background * size
+    rows = [blank] * margin
+    for y in range(GRID):
+        pixels = background * margin
+        for x in range(GRID):
+            # 右侧两列与左侧两列对称
+            column = x if x <= GRID // 2 else GRID - 1 - x
+            filled = bits >> (y * (GRID // 2 + 1) + column) & 1
+            pixels += (color if filled else background) * cell
+        pixels += background * (size - margin - cell * GRID)
+        rows.extend([pixels] * cell)
+    rows.extend([blank] * (size - len(rows)))
+    return _png(size, size, rows)
+
+
+def render_identicon(digest, sizes):
+    '''在进程池中执行，返回 {尺寸: PNG}'''
+    return {size: identicon(digest, size) for size in sizes}
+
+
+def resize_upload(data, sizes):
+    '''
+    在进程池中执行：把上传的图片裁剪为正方形并缩放为各种尺寸，
+    返回 (哈希, {尺寸: PNG}) ，不是图片时抛出 ValueError
+    '''
+    from PIL import Image
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except Exception as e:
+        raise ValueError('无法识别的图片：{}'.format(e))
+    image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    side = min(image.size)
+    left = (image.width - side) // 2
+    top = (image.height - side) // 2
+    image = image.crop((left, top, left + side, top + side))
+    images = {}
+    for size in sizes:
+        output = io.BytesIO()
+        image.resize((size, size), Image.LANCZOS).save(output, 'PNG',
+                optimize=True)
+        images[size] = output.getvalue()
+    return hashlib.sha1(data).hexdigest(), images
+
+
+class AvatarStore:
+    '''头像文件的生成、保存和地址'''
+
+    def __init__(self):
+        self.directory = None
+        self.sizes = [40, 80, 160, 320]
+        self.workers = 0
+        # gevent 模式下替换为在原生线程中执行的线程池，见 cooperative.py
+        self.executor_class = ProcessPoolExecutor
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.directory = app.config['AVATAR_DIR'] or os.path.join(
+                app.instance_path, 'avatars')
+        self.sizes = sorted(app.config['AVATAR_SIZES'])
+        self.workers = app.config['AVATAR_WORKERS']
+        app.add_template_global(self.url, 'avatar_url')
+
+    @property
+    def can_upload(self):
+        return importlib.util.find_spec('PIL') is not None
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = self.executor_class(self.workers)
+            return self._executor
+
+    def _run(self, func, *args):
+        if not self.workers:
+            return func(*args)
+        return self._get_executor().submit(func, *args).result()
+
+    def path(self, digest, size):
+        return os.path.join(self.directory, digest[:2], digest,
+                '{}.png'.format(size))
+
+    def exists(self, digest):
+        return all(os.path.exists(self.path(digest, size))
+                   for size in self.sizes)
+
+    def save(self, digest, images):
+        for size, data in images.items():
+            path = self.path(digest, size)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先写入临时文件再改名，其他进程不会读到写了一半的文件
+            temp = '{}.{}.tmp'.format(path, os.getpid())
+            with open(temp, 'wb') as f:
+                f.write(data)
+            os.replace(temp, path)
+
+    def generate(self, digest):
+        '''生成 identicon 的各种尺寸，已经存在时跳过'''
+        if not self.exists(digest):
+            self.save(digest, self._run(render_identicon, digest, self.sizes))
+
+    def generate_later(self, digests):
+        '''在后台生成，不等待结果'''
+        digests = [d for d in digests if not self.exists(d)]
+        if not digests:
+            return
+        if not self.workers:
+            for digest in digests:
+                self.generate(digest)
+            return
+        executor = self._get_executor()
+        for digest in digests:
+            future = executor.submit(render_identicon, digest, self.sizes)
+            future.add_done_callback(lambda f, digest=digest:
+                    f.exception() is None and self.save(digest, f.result()))
+
+    def upload(self, data):
+        '''保存上传的图片，返回作为 avatar_hash 的哈希值'''
+        digest, images = self._run(resize_upload, data, self.sizes)
+        self.save(digest, images)
+        return digest
+
+    def size_for(self, size):
+        '''不小于 size 的最小尺寸，都小于 size 时使用最大的尺寸'''
+        for available in self.sizes:
+            if available >= size:
+                return available
+        return self.sizes[-1]
+
+    def url(self, user, size):
+        '''模板中使用的头像地址'''
+        if not user.avatar_hash:
+            return url_for('static', filename='favicon.ico')
+        return url_for('avatars.avatar', digest=user.avatar_hash,
+                size=self.size_for(size))
+
+
+store = AvatarStore()
+
+
+def on_change_email(target, value, old_value, initiator):
+    '''邮箱变化时更新 avatar_hash ，用户上传过头像时保留上传的头像'''
+    if value is None:
+        return
+    old_hash = email_hash(old_value) if isinstance(old_value, str) else None
+    if target.avatar_hash is None or target.avatar_hash == old_hash:
+        target.avatar_hash = email_hash(value)
+        target._avatar_pending = True
+
+
+def collect_pending(session, flush_context):
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, User) and obj.__dict__.pop('_avatar_pending',
+                False):
+            session.info.setdefault('avatar_pending', []).append(
+                    obj.avatar_hash)
+
+
+def submit_pending(session):
+    '''事务提交之后再生成，回滚的修改不会留下文件'''
+    pending = session.info.pop('avatar_pending', None)
+    if pending:
+        store.generate_later(pending)
+
+
+def discard_pending(session, *args):
+    session.info.pop('avatar_pending', None)
+
+
+db.event.listen(User.email, 'set', on_change_email)
+db.event.listen(db.session, 'after_flush', collect_pending)
+db.event.listen(db.session, 'after_commit', submit_pending)
+db.event.listen(db.session, 'after_rollback', discard_pending)
+
+
+def backfill(batch_size=500):
+    '''
+    为 avatar_hash 为空的用户计算哈希，并为所有用户生成还不存在的 identicon ，
+    返回生成的数量
+    '''
+    users = User.__table__
+    rows = db.session.query(User.id, User.email).filter(
+            User.avatar_hash == None, User.email != None).all()
+    for start in range(0, len(rows), batch_size):
+        db.session.execute(users.update().where(
+                users.c.id == db.bindparam('user_id')).values(
+                avatar_hash=db.bindparam('digest')),
+                [{'user_id': user_id, 'digest': email_hash(email)}
+                 for user_id, email in rows[start:start + batch_size]])
+        db.session.commit()
+    count = 0
+    for (digest,) in db.session.query(User.avatar_hash).filter(
+            db.func.length(User.avatar_hash) == IDENTICON_HASH_LENGTH):
+        if not store.exists(digest):
+            store.generate(digest)
+            count += 1
+    return count
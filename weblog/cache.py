@@ -0,0 +1,363 @@
+'''
+页面缓存和模板片段缓存
+
+- 未登录用户访问的页面内容都相同，整页缓存起来，命中时不查询数据库也不渲染模板
+- 每篇博客渲染好的 HTML 片段按博客 ID 和更新时间缓存，登录用户的页面也能用到
+- 缓存的页面带有 ETag 和 Last-Modified ，浏览器再次请求时可以直接返回 304
+- 缓存保存在进程内存（memory）或文件系统（filesystem）中，由 CACHE_TYPE 指定，
+  多个进程共享缓存时使用 filesystem
+- 每个页面声明自己依赖的范围（首页列表、热门、某篇博客、某个用户的主页），
+  博客、评论、用户和关注关系变化并提交之后，只有相关范围的页面失效
+'''
+
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from functools import wraps
+
+from flask import current_app, request, session, make_response
+from flask_login import current_user
+from markupsafe import Markup
+
+from .models import db, Blog, Comment, User, Follow
+
+
+class LRUCache:
+    '''线程安全的 LRU 缓存，容量满了之后淘汰最久没有使用的数据'''
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class NullBackend:
+    '''不缓存任何数据，用于关闭缓存'''
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, timeout):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+class MemoryBackend(NullBackend):
+    '''保存在当前进程内存中的缓存，数据带有过期时间'''
+
+    def __init__(self, maxsize=2000):
+        self._lru = LRUCache(maxsize)
+
+    def get(self, key):
+        entry = self._lru.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires and expires < time.time():
+            self._lru.delete(key)
+            return None
+        return value
+
+    def set(self, key, value, timeout):
+        self._lru.set(key, (time.time() + timeout if timeout else 0, value))
+
+    def delete(self, key):
+        self._lru.delete(key)
+
+    def clear(self):
+        self._lru.clear()
+
+
+class FileSystemBackend(NullBackend):
+    '''
+    保存在文件系统中的缓存，同一台机器上的多个进程可以共享
+    每个键对应一个文件，写入时先写临时文件再改名，其他进程不会读到写了一半的数据
+    '''
+
+    def __init__(self, directory, max_entries=2000):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory,
+                hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                expires, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if expires and expires < time.time():
+            self.delete(key)
+            return None
+        return value
+
+    def set(self, key, value, timeout):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((time.time() + timeout if timeout else 0, value), f,
+                    pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._path(key))
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self.prune()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def prune(self):
+        '''文件数量超过 max_entries 时，删除最早写入的文件'''
+        try:
+            entries = [e for e in os.scandir(self.directory)
+                    if e.is_file() and not e.name.endswith('.tmp')]
+        except OSError:
+            return
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        for entry in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+class PageCache:
+    '''
+    整页缓存和片段缓存的入口
+    页面缓存的键包含它依赖的每个范围的「代数」，范围内的内容变化时换一个新的代数，
+    之前缓存的页面不再被读到。代数是随机生成的，单独保存，不会被页面挤出缓存；
+    即使丢失也只会生成新的代数，让页面失效，不会回到旧的代数读到过期的页面
+    '''
+
+    def __init__(self):
+        self.backend = NullBackend()
+        self.generations = NullBackend()
+        self.app = None
+
+    def init_app(self, app):
+        self.app = app
+        cache_type = app.config['CACHE_TYPE']
+        max_entries = app.config['CACHE_MAX_ENTRIES']
+        if cache_type == 'memory':
+            self.backend = MemoryBackend(max_entries)
+            self.generations = MemoryBackend(max_entries)
+        elif cache_type == 'filesystem':
+            directory = app.config['CACHE_DIR'] or os.path.join(
+                    app.instance_path, 'cache')
+            self.backend = FileSystemBackend(directory, max_entries)
+            # 代数保存在子目录中，清理页面文件时不会删除
+            self.generations = FileSystemBackend(
+                    os.path.join(directory, 'generations'), max_entries)
+        elif cache_type == 'null':
+            self.backend = NullBackend()
+            self.generations = NullBackend()
+        else:
+            raise ValueError('未知的 CACHE_TYPE ：{}'.format(cache_type))
+        app.add_template_global(self.fragment, 'cache_fragment')
+
+    def generation(self, scope):
+        '''范围现在的代数，还没有时生成一个'''
+        token = self.generations.get(scope)
+        if token is None:
+            token = os.urandom(8).hex()
+            self.generations.set(scope, token, 0)
+        return token
+
+    def invalidate(self, *scopes):
+        '''让这些范围的页面失效，不指定范围时清空所有缓存的页面'''
+        if not scopes:
+            self.backend.clear()
+        for scope in scopes:
+            self.generations.set(scope, os.urandom(8).hex(), 0)
+
+    def fragment(self, *key_parts, timeout=None, caller=None):
+        '''
+        模板中缓存一段 HTML ，用法：
+        {% call cache_fragment('blog', blog.id, blog.updated_at) %}...{% endcall %}
+        键中包含更新时间，内容变化后自然使用新的键
+        '''
+        key = 'fragment:' + ':'.join(str(part) for part in key_parts)
+        html = self.backend.get(key)
+        if html is None:
+            html = str(caller())
+            self.backend.set(key, html,
+                    timeout or self.app.config['CACHE_DEFAULT_TIMEOUT'])
+        return Markup(html)
+
+    def cacheable(self):
+        '''只缓存未登录用户的 GET 请求，有待显示的 flash 消息时不缓存'''
+        return (self.app.config['CACHE_PAGES'] and request.method == 'GET'
+                and not current_user.is_authenticated
+                and '_flashes' not in session)
+
+    def cached_page(self, scopes=(), timeout=None):
+        '''
+        视图函数的装饰器，为未登录用户缓存整个页面
+        scopes 是页面依赖的范围，可以引用视图的参数，例如 ('blog:{id}',)
+        '''
+        def decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                if not self.cacheable():
+                    return f(*args, **kwargs)
+                key = 'page:{}:{}'.format('.'.join(self.generation(
+                        scope.format(**kwargs)) for scope in scopes),
+                        request.full_path)
+                entry = self.backend.get(key)
+                if entry is None:
+                    response = make_response(f(*args, **kwargs))
+                    if response.status_code != 200 or response.is_streamed:
+                        return response
+                    body = response.get_data()
+                    entry = {
+                        'body': body,
+                        'content_type': response.content_type,
+                        'etag': hashlib.md5(body).hexdigest(),
+                        'last_modified': datetime.utcnow().replace(
+                                microsecond=0),
+                    }
+                    self.backend.set(key, entry, timeout or
+                            self.app.config['CACHE_DEFAULT_TIMEOUT'])
+                response = current_app.response_class(entry['body'],
+                        content_type=entry['content_type'])
+                response.set_etag(entry['etag'])
+                response.last_modified = entry['last_modified']
+                # 浏览器每次都要带着 ETag 验证，内容没有变化时返回 304
+                response.cache_control.public = True
+                response.cache_control.max_age = 0
+                response.vary.add('Cookie')
+                return response.make_conditional(request)
+            return wrapper
+        return decorator
+
+
+page_cache = PageCache()
+
+
+users = User.__table__
+
+
+def blog_scopes(blog_id, author_name):
+    '''一篇博客变化时失效的范围：首页、热门、博客页面和作者的主页'''
+    return ('listing', 'hot', 'blog:{}'.format(blog_id),
+            'user:{}'.format(author_name))
+
+
+def _pending(target):
+    '''记下失效的范围，事务提交之后再让页面失效'''
+    session = db.object_session(target)
+    if session is None:
+        return set()
+    return session.info.setdefault('page_cache_scopes', set())
+
+
+def _user_scopes(connection, *user_ids):
+    rows = connection.execute(db.select([users.c.name]).where(
+            users.c.id.in_(user_ids)))
+    return ['user:{}'.format(name) for name, in rows]
+
+
+def on_blog_change(mapper, connection, blog):
+    # 作者的主页上有博客列表和博客数
+    name = connection.execute(db.select([users.c.name]).where(
+            users.c.id == blog.author_id)).scalar()
+    _pending(blog).update(blog_scopes(blog.id, name))
+
+
+def on_comment_change(mapper, connection, comment):
+    # 评论会改变博客的热度
+    _pending(comment).update(('blog:{}'.format(comment.blog_id), 'hot'))
+
+
+def on_follow_change(mapper, connection, follow):
+    # 双方主页上的关注数和粉丝数，以及作者博客的热度
+    scopes = _pending(follow)
+    scopes.update(_user_scopes(connection, follow.follower_id,
+            follow.followed_id))
+    scopes.add('hot')
+
+
+def on_user_update(mapper, connection, user):
+    '''用户名和头像显示在所有页面的博客和评论中，变化时清空缓存的页面'''
+    state = db.inspect(user)
+    if state.attrs.name.history.has_changes() or \
+            state.attrs.avatar_hash.history.has_changes():
+        on_user_delete(mapper, connection, user)
+    else:
+        _pending(user).add('user:{}'.format(user.name))
+
+
+def on_user_delete(mapper, connection, user):
+    session = db.object_session(user)
+    if session is not None:
+        session.info['page_cache_clear'] = True
+
+
+def invalidate_on_commit(session):
+    scopes = session.info.pop('page_cache_scopes', None)
+    if session.info.pop('page_cache_clear', False):
+        page_cache.invalidate()
+    elif scopes:
+        page_cache.invalidate(*scopes)
+
+
+def discard_on_rollback(session, *args):
+    session.info.pop('page_cache_scopes', None)
+    session.info.pop('page_cache_clear', None)
+
+
+for event in ('after_insert', 'after_update', 'after_delete'):
+    db.event.listen(Blog, event, on_blog_change)
+    db.event.listen(Comment, event, on_comment_change)
+db.event.listen(Follow, 'after_insert', on_follow_change)
+db.event.listen(Follow, 'after_delete', on_follow_change)
+db.event.listen(User, 'after_update', on_user_update)
+db.event.listen(User, 'after_delete', on_user_delete)
+db.event.listen(db.session, 'after_commit', invalidate_on_commit)
+db.event.listen(db.session, 'after_rollback', discard_on_rollback)
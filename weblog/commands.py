@@ -0,0 +1,180 @@
+'''
+自定义的 flask 命令行命令，在 app.py 文件中统一注册
+'''
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from . import feed, markup, graph, stats, search, comments, audit, assets
+from . import startup, avatars, hot
+from .models import User
+
+feed_cli = AppGroup('feed', help='「我关注的人的博客」动态表相关命令')
+
+
+@feed_cli.command('rebuild')
+@click.option('--user', 'name', default=None, help='只重建该用户的动态')
+def feed_rebuild(name):
+    '''根据当前的关注关系重建动态表'''
+    user_ids = None
+    if name:
+        user = User.query.filter_by(name=name).first()
+        if not user:
+            raise click.BadParameter('用户 {} 不存在'.format(name))
+        user_ids = [user.id]
+    count = feed.rebuild(user_ids)
+    click.echo('已重建 {} 个用户的动态'.format(count))
+
+
+markdown_cli = AppGroup('markdown', help='博客正文渲染相关命令')
+
+
+@markdown_cli.command('render')
+@click.option('--all', 'rerender', is_flag=True,
+        help='重新渲染全部博客，默认只渲染 body_html 为空的博客')
+@click.option('--batch-size', default=500, show_default=True)
+def markdown_render(rerender, batch_size):
+    '''批量渲染已有博客的正文'''
+    count = markup.render_all(rerender, batch_size)
+    click.echo('已渲染 {} 篇博客'.format(count))
+
+
+graph_cli = AppGroup('graph', help='关注关系相关命令')
+
+
+@graph_cli.command('recount')
+def graph_recount():
+    '''重新计算每个用户的关注数和粉丝数'''
+    graph.recount()
+    click.echo('关注数和粉丝数已更新')
+
+
+stats_cli = AppGroup('stats', help='用户统计数据相关命令')
+
+
+@stats_cli.command('reconcile')
+def stats_reconcile():
+    '''根据博客和评论重建每个用户的统计数据'''
+    count = stats.reconcile()
+    click.echo('已重建 {} 个用户的统计数据'.format(count))
+
+
+search_cli = AppGroup('search', help='全文搜索相关命令')
+
+
+@search_cli.command('reindex')
+@click.option('--batch-size', default=500, show_default=True)
+def search_reindex(batch_size):
+    '''清空并重建全文索引'''
+    count = search.reindex(batch_size)
+    click.echo('已索引 {} 篇文档'.format(count))
+
+
+comment_cli = AppGroup('comment', help='评论相关命令')
+
+
+@comment_cli.command('recount')
+def comment_recount():
+    '''重新计算每篇博客的评论数'''
+    comments.recount()
+    click.echo('评论数已更新')
+
+
+schema_cli = AppGroup('schema', help='数据库结构相关命令')
+
+
+@schema_cli.command('audit')
+@click.option('--path', 'paths', multiple=True,
+        help='要检查的页面，可以指定多次，默认根据已有数据选择')
+@click.option('--verbose', is_flag=True, help='同时输出没有问题的查询')
+def schema_audit(paths, verbose):
+    '''对视图执行的查询运行 EXPLAIN ，发现全表扫描时退出码为 1'''
+    report = audit.audit(current_app._get_current_object(), list(paths))
+    flagged = 0
+    for label, statement, lines, problems in report:
+        if problems:
+            flagged += 1
+        elif not verbose:
+            continue
+        click.echo('== {}'.format(label))
+        click.echo(statement)
+        for line in lines:
+            click.echo('    ' + line)
+        for problem in problems:
+            click.secho('  ! ' + problem, fg='red')
+        click.echo()
+    click.echo('检查了 {} 条查询，其中 {} 条有问题'.format(len(report), flagged))
+    if flagged:
+        raise click.exceptions.Exit(1)
+
+
+assets_cli = AppGroup('assets', help='静态文件相关命令')
+
+
+@assets_cli.command('build')
+def assets_build():
+    '''生成带哈希值和压缩版本的静态文件，以及 manifest.json'''
+    count = assets.build()
+    click.echo('已发布 {} 个静态文件'.format(count))
+
+
+@assets_cli.command('fetch')
+def assets_fetch():
+    '''下载 Moment.js 和 PageDown 到 static/vendor ，之后需要重新 build'''
+    for name in assets.fetch():
+        click.echo('已下载 ' + name)
+
+
+startup_cli = AppGroup('startup', help='应用启动相关命令')
+
+
+@startup_cli.command('report')
+@click.option('--top', default=20, show_default=True,
+        help='输出导入耗时最长的多少个包')
+def startup_report(top):
+    '''输出创建应用每一步的耗时，以及导入各个包的耗时'''
+    click.echo('创建应用：')
+    for line in current_app.extensions['startup'].report():
+        click.echo('    ' + line)
+    click.echo('导入模块（在新的进程中测量）：')
+    for name, seconds in startup.import_times()[:top]:
+        click.echo('    {:<28} {:>8.1f} ms'.format(name, seconds * 1000))
+
+
+@startup_cli.command('compile')
+def startup_compile():
+    '''编译全部模板并写入 JINJA_BYTECODE_CACHE_DIR ，部署时在启动进程之前执行'''
+    app = current_app._get_current_object()
+    if app.jinja_env.bytecode_cache is None:
+        raise click.UsageError('JINJA_BYTECODE_CACHE 没有打开')
+    count = startup.warm_up(app)
+    click.echo('已编译 {} 个模板'.format(count))
+
+
+avatars_cli = AppGroup('avatars', help='用户头像相关命令')
+
+
+@avatars_cli.command('generate')
+@click.option('--batch-size', default=500, show_default=True)
+def avatars_generate(batch_size):
+    '''补全用户的 avatar_hash ，并生成还不存在的 identicon'''
+    count = avatars.backfill(batch_size)
+    click.echo('已生成 {} 个头像'.format(count))
+
+
+hot_cli = AppGroup('hot', help='热门博客相关命令')
+
+
+@hot_cli.command('rebuild')
+@click.option('--batch-size', default=500, show_default=True)
+def hot_rebuild(batch_size):
+    '''根据博客和评论重新计算全部博客的热度'''
+    count = hot.rebuild(batch_size)
+    click.echo('已计算 {} 篇博客的热度'.format(count))
+
+
+# 命令列表，便于 app.py 文件中的应用注册
+command_list = [feed_cli, markdown_cli, graph_cli, stats_cli, search_cli,
+        comment_cli, schema_cli, assets_cli, startup_cli, avatars_cli,
+        hot_cli]
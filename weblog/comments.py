@@ -0,0 +1,75 @@
+'''
+博客评论的分页和计数
+
+- Blog.comment_count 冗余存储可见评论的数量，评论增删和隐藏时在同一个事务中更新，
+  评论者在 user_stats 中的评论数同时更新
+- 评论按 (时间, id) 游标分页，评论者通过联结查询一并加载
+- 被隐藏的评论在查询中过滤，只有协管员能看到
+'''
+
+from .models import db, Blog, Comment
+from .pagination import keyset_paginate
+from . import stats
+
+blogs = Blog.__table__
+
+
+def _visible(comment):
+    return not comment.disable
+
+
+def _change_count(connection, comment, delta):
+    connection.execute(blogs.update().where(blogs.c.id == comment.blog_id)
+            .values(comment_count=blogs.c.comment_count + delta))
+    stats.change(connection, comment.author_id, comment_count=delta)
+
+
+def on_insert(mapper, connection, comment):
+    if _visible(comment):
+        _change_count(connection, comment, 1)
+
+
+def on_delete(mapper, connection, comment):
+    if _visible(comment):
+        _change_count(connection, comment, -1)
+
+
+def on_update(mapper, connection, comment):
+    '''评论被隐藏或恢复时更新可见评论数'''
+    history = db.inspect(comment).attrs.disable.history
+    if not history.has_changes():
+        return
+    was_visible = not (history.deleted and history.deleted[0])
+    if was_visible != _visible(comment):
+        _change_count(connection, comment,
+                1 if _visible(comment) else -1)
+
+
+db.event.listen(Comment, 'after_insert', on_insert)
+db.event.listen(Comment, 'after_delete', on_delete)
+db.event.listen(Comment, 'after_update', on_update)
+
+
+def comments_page(blog, cursor=None, per_page=10, moderate=False):
+    '''
+    blog 的评论，按时间倒序游标分页
+    moderate 为 False 时不返回被隐藏的评论
+    '''
+
+    query = Comment.query.filter(Comment.blog_id == blog.id).options(
+            db.joinedload(Comment.author))
+    if not moderate:
+        query = query.filter(db.or_(Comment.disable == False,
+                Comment.disable == None))
+    return keyset_paginate(query, Comment.time_stamp, Comment.id, cursor,
+            per_page)
+
+
+def recount():
+    '''根据评论表重新计算每篇博客的可见评论数'''
+    count = db.select([db.func.count()]).where(db.and_(
+            Comment.blog_id == blogs.c.id,
+            db.or_(Comment.disable == False, Comment.disable == None))
+            ).as_scalar()
+    db.session.execute(blogs.update().values(comment_count=count))
+    db.session.commit()
@@ -0,0 +1,55 @@
+'''
+gevent 协作式并发模式
+
+默认的部署方式每个连接占用一个线程，等待数据库和 SMTP 时线程都在阻塞，
+保持大量 keep-alive 连接就需要同样多的线程。gevent 模式下每个连接是一个 greenlet ：
+
+- 进程启动时最先执行 monkey.patch_all() ，socket 、threading 、queue 等都替换为协作式的版本。
+  pymysql 是纯 Python 实现，等待 MySQL 返回时会切换到其他 greenlet ；
+  MySQLdb 等 C 扩展的驱动会阻塞整个进程，不能在这个模式下使用
+- Flask-SQLAlchemy 的会话按应用上下文所在的 greenlet 区分，每个请求使用自己的会话；
+  连接池的大小由 GeventConfig 设置，greenlet 多于连接数时在连接池上排队等待
+- 邮件队列的工作线程变为 greenlet ，smtplib 的网络读写同样是协作式的
+- 计算密码哈希和缩放头像等 CPU 密集的任务仍然要离开事件循环执行，
+  multiprocessing 不能与 monkey patch 一起使用，这里改为 gevent 的原生线程池，
+  pbkdf2 和 Pillow 在计算时会释放 GIL
+
+启动方式见仓库根目录的 gevent_server.py ，也可以使用 gunicorn -k gevent 。
+'''
+
+from flask import _app_ctx_stack
+
+
+def init_app(app):
+    '''CONCURRENCY 为 gevent 时在 create_app 中调用'''
+    import gevent
+    from gevent import monkey
+    from gevent.threadpool import ThreadPoolExecutor
+
+    from .passwords import hasher
+    from .avatars import store
+
+    # 没有打补丁时数据库和 SMTP 的读写会阻塞整个进程，宁可启动失败
+    if not monkey.is_module_patched('socket') or \
+            not monkey.is_module_patched('threading'):
+        raise RuntimeError('CONCURRENCY 为 gevent 时，必须在导入其他模块之前'
+                '执行 gevent.monkey.patch_all()')
+    # Flask-SQLAlchemy 的 scoped_session 使用应用上下文的标识函数区分作用域，
+    # 安装了 greenlet 时 werkzeug 使用 greenlet.getcurrent
+    if _app_ctx_stack.__ident_func__() is not gevent.getcurrent():
+        raise RuntimeError('数据库会话没有按 greenlet 区分')
+    hasher.executor_class = ThreadPoolExecutor
+    store.executor_class = ThreadPoolExecutor
+
+
+def make_server(app, host='127.0.0.1', port=5000):
+    '''
+    创建 gevent 的 WSGI 服务器，每个连接一个 greenlet ，
+    同时处理的连接数不超过 GEVENT_MAX_CONNECTIONS
+    '''
+    from gevent.pool import Pool
+    from gevent.pywsgi import WSGIServer
+
+    # 连接数很多时逐条输出访问日志的开销很大，访问日志交给前面的反向代理
+    return WSGIServer((host, port), app,
+            spawn=Pool(app.config['GEVENT_MAX_CONNECTIONS']), log=None)
@@ -1,25 +1,168 @@
-from flask import current_app, render_template, flash
+from flask import current_app, render_template
 from flask_mail import Mail, Message
-from threading import Thread
+from threading import Thread, Lock
+import atexit
+import queue
+import smtplib
+import time
 
+mail = Mail()
 
-def send_async_email(app, msg):
-    '''该函数作为线程类实例化时 target 参数的值，在线程中执行'''
+# 放入队列后通知工作线程退出
+_STOP = object()
 
-    with app.app_context():
-        Mail(app).send(msg)
+
+class MailQueue:
+    '''
+    后台发送邮件的线程池
+    邮件先放入一个有长度限制的队列，固定数量的工作线程从队列中取出邮件发送
+    每个工作线程保持一个 SMTP 连接，队列中连续的多封邮件使用同一个连接发送
+    连接空闲 MAIL_IDLE_TIMEOUT 秒后断开，发送失败时重新连接并按指数退避重试
+    任何一封邮件出错都只记为失败，工作线程继续发送后面的邮件
+    '''
+
+    def __init__(self):
+        self.app = None
+        self.queue = None
+        self._threads = []
+        # 保护工作线程列表和下面的计数，计数在多个工作线程和请求线程中修改
+        self._lock = Lock()
+        self.sent = 0           # 发送成功的邮件数
+        self.failed = 0         # 重试之后仍然失败的邮件数
+        self.retried = 0        # 重试次数
+        self.dropped = 0        # 队列已满被丢弃的邮件数
+
+    def init_app(self, app):
+        self.app = app
+        self.queue = queue.Queue(maxsize=app.config['MAIL_QUEUE_SIZE'])
+        atexit.register(self.shutdown)
+
+    def _start(self):
+        '''第一次发送邮件时才启动工作线程'''
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.app.config['MAIL_WORKERS']):
+                thread = Thread(target=self._work, name='mail-%d' % i,
+                        daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def put(self, msg):
+        '''把邮件放入队列，队列已满时最多等待 MAIL_QUEUE_TIMEOUT 秒'''
+        self._start()
+        try:
+            self.queue.put(msg, timeout=self.app.config['MAIL_QUEUE_TIMEOUT'])
+        except queue.Full:
+            self._count('dropped')
+            self.app.logger.error('邮件队列已满，丢弃发给 %s 的邮件',
+                    msg.recipients)
+            return False
+        return True
+
+    def _work(self):
+        with self.app.app_context():
+            conn = None
+            while True:
+                try:
+                    msg = self.queue.get(
+                            timeout=self.app.config['MAIL_IDLE_TIMEOUT'])
+                except queue.Empty:
+                    conn = self._close(conn)
+                    continue
+                # 取出队列中已有的邮件，使用同一个连接连续发送
+                batch = [msg]
+                while msg is not _STOP and \
+                        len(batch) < self.app.config['MAIL_BATCH_SIZE']:
+                    try:
+                        msg = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    batch.append(msg)
+                for msg in batch:
+                    if msg is _STOP:
+                        self._close(conn)
+                        return
+                    conn = self._deliver(conn, msg)
+
+    def _deliver(self, conn, msg):
+        '''发送一封邮件，返回可以继续使用的连接'''
+        retries = self.app.config['MAIL_MAX_RETRIES']
+        for attempt in range(retries + 1):
+            try:
+                if conn is None:
+                    # 连接失败时 __enter__ 抛出异常，conn 仍然为 None
+                    conn = mail.connect().__enter__()
+                conn.send(msg)
+                self._count('sent')
+                return conn
+            except smtplib.SMTPRecipientsRefused:
+                # 收件人地址有误，重试也不会成功
+                break
+            except (smtplib.SMTPException, OSError):
+                conn = self._close(conn)
+                if attempt < retries:
+                    self._count('retried')
+                    time.sleep(self.app.config['MAIL_RETRY_BACKOFF'] *
+                            2 ** attempt)
+            except Exception:
+                # 邮件本身有问题，例如标题中有换行（BadHeaderError）或无法编码的字符，
+                # 重试也不会成功；连接的状态不确定，关闭后下一封重新连接
+                self.app.logger.exception('发给 %s 的邮件无法发送',
+                        msg.recipients)
+                conn = self._close(conn)
+                break
+        self._count('failed')
+        self.app.logger.error('发给 %s 的邮件发送失败', msg.recipients)
+        return conn
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _close(self, conn):
+        if conn is not None:
+            try:
+                conn.__exit__(None, None, None)
+            except Exception:
+                pass
+        return None
+
+    def shutdown(self, timeout=10):
+        '''通知工作线程发送完队列中的邮件后退出'''
+        for thread in self._threads:
+            try:
+                self.queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                return
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def stats(self):
+        '''队列长度和发送数量，供监控使用'''
+        with self._lock:
+            return {
+                'queue_depth': self.queue.qsize() if self.queue else 0,
+                'workers': len(self._threads),
+                'sent': self.sent,
+                'failed': self.failed,
+                'retried': self.retried,
+                'dropped': self.dropped,
+            }
+
+
+mail_queue = MailQueue()
 
 
 def send_email(user, email, tmp, token):
     '''
     发送邮件的主函数，参数分别是：
     当前登录用户，收件人的邮箱，前端文件名片段，token
+    邮件在当前请求中渲染好之后放入队列，由后台线程发送
+    返回值表示邮件是否成功放入队列
     '''
 
-    # 如果使用多线程，就不能用 current_app 了，它被看作是一个代理
-    # 类似 socket 服务器中的主套接字，每次接收请求后都要创建一个临时套接字去处理
-    # 此处使用 current_app 对象的 _get_curent_object 方法
-    # 新创建的临时应用对象 app 包含独立的上下文信息，交给子线程处理
     app = current_app._get_current_object()
     # Message 是一个类，它接收以下参数：
     # 1、默认参数 subject 字符串（邮件主题
@@ -34,6 +177,4 @@ def send_email(user, email, tmp, token):
             token=token)    # 纯文本文件
     msg.html = render_template('email/{}.html'.format(tmp), user=user,
             token=token)    # HTML 文件
-    thread = Thread(target=send_async_email, args=(app, msg))
-    thread.start()          # 创建一个子线程并启动
-    return thread
\ No newline at end of file
+    return mail_queue.put(msg)
@@ -0,0 +1,247 @@
+'''
+导出用户的博客和评论
+
+- 支持两种格式：ndjson 每行一个 JSON 对象；zip 中每篇博客一个 Markdown 文件，
+  评论合并为一个 comments.md
+- 数据用 yield_per 分批读取（MySQL 使用服务器端游标），每读出一行就编码并发送，
+  zip 边压缩边输出，不需要可以 seek 的文件，内存占用与博客数量无关
+- 博客不超过 EXPORT_SYNC_LIMIT 篇时在请求中直接流式下载；更多时在后台生成文件，
+  生成好之后用支持 Range 的下载地址提供，中断后可以续传。
+  后台任务的状态就是 EXPORT_DIR 中的文件：生成中为 .part ，失败为 .error ，
+  超过 EXPORT_STALE_AFTER 秒没有写入的 .part 也当作失败，
+  超过 EXPORT_TTL 秒的文件在创建新任务时删除
+'''
+
+import json
+import os
+import secrets
+import threading
+import time
+import unicodedata
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import current_app
+from werkzeug.urls import url_quote
+
+from .models import db, Blog, Comment
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'zip': 'application/zip',
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _iso(value):
+    return value.isoformat() if value is not None else None
+
+
+def iter_blogs(user_id, batch_size):
+    '''按发布时间顺序逐行读取博客，不加载 ORM 实例'''
+    return db.session.query(Blog.id, Blog.body, Blog.time_stamp,
+            Blog.updated_at, Blog.comment_count).filter(
+            Blog.author_id == user_id).order_by(
+            Blog.time_stamp, Blog.id).yield_per(batch_size)
+
+
+def iter_comments(user_id, batch_size):
+    return db.session.query(Comment.id, Comment.blog_id, Comment.body,
+            Comment.time_stamp, Comment.disable).filter(
+            Comment.author_id == user_id).order_by(
+            Comment.id).yield_per(batch_size)
+
+
+def ndjson(user, batch_size):
+    '''逐行生成 NDJSON ，每行带有 type 字段区分博客和评论'''
+    for row in iter_blogs(user.id, batch_size):
+        yield _line({'type': 'blog', 'id': row.id, 'body': row.body,
+                'time_stamp': _iso(row.time_stamp),
+                'updated_at': _iso(row.updated_at),
+                'comment_count': row.comment_count})
+    for row in iter_comments(user.id, batch_size):
+        yield _line({'type': 'comment', 'id': row.id, 'blog_id': row.blog_id,
+                'body': row.body, 'time_stamp': _iso(row.time_stamp),
+                'hidden': bool(row.disable)})
+
+
+def _line(obj):
+    return (json.dumps(obj, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+class _Chunks:
+    '''zipfile 的输出目标，写入的数据暂存起来，由生成器取走'''
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def markdown_zip(user, batch_size):
+    '''
+    逐个文件生成 zip 。输出不能 seek ，zipfile 会把文件大小和 CRC
+    写在每个文件的数据之后
+    '''
+    output = _Chunks()
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for row in iter_blogs(user.id, batch_size):
+            info = zipfile.ZipInfo('blogs/{:%Y-%m-%d}-{}.md'.format(
+                    row.time_stamp, row.id), row.time_stamp.timetuple()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            archive.writestr(info, '---\nid: {}\ntime_stamp: {}\n'
+                    'comment_count: {}\n---\n\n{}\n'.format(row.id,
+                    _iso(row.time_stamp), row.comment_count,
+                    row.body or ''))
+            yield output.take()
+        # 所有评论写入同一个文件，每读出一条就压缩并输出
+        with archive.open('comments.md', 'w') as f:
+            for row in iter_comments(user.id, batch_size):
+                f.write('## 评论 {} （博客 {}，{}{}）\n\n{}\n\n'.format(row.id,
+                        row.blog_id, _iso(row.time_stamp),
+                        '，已隐藏' if row.disable else '',
+                        row.body or '').encode('utf-8'))
+                yield output.take()
+    yield output.take()
+
+
+def generate(user, fmt):
+    '''按格式返回导出内容的生成器'''
+    batch_size = current_app.config['EXPORT_BATCH_SIZE']
+    if fmt == 'zip':
+        return markdown_zip(user, batch_size)
+    return ndjson(user, batch_size)
+
+
+def filename(user, fmt):
+    return '{}-export.{}'.format(user.name, fmt)
+
+
+def disposition(name):
+    '''
+    Content-Disposition 的参数，与 send_file 的处理相同：
+    用户名可能包含中文，响应头只能是 latin-1 ，另外用 filename* 给出 UTF-8 的文件名
+    '''
+    try:
+        name.encode('ascii')
+    except UnicodeEncodeError:
+        return {'filename': unicodedata.normalize('NFKD', name).encode(
+                'ascii', 'ignore').decode('ascii'),
+                'filename*': "UTF-8''{}".format(url_quote(name, safe=''))}
+    return {'filename': name}
+
+
+# 后台任务
+
+def _directory(app):
+    directory = app.config['EXPORT_DIR'] or os.path.join(app.instance_path,
+            'exports')
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def _get_executor(app):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                    max_workers=app.config['EXPORT_WORKERS'],
+                    thread_name_prefix='export')
+    return _executor
+
+
+def job_path(app, user_id, token, fmt):
+    return os.path.join(_directory(app), '{}-{}.{}'.format(user_id, token,
+            fmt))
+
+
+def _run_job(app, user_id, path, fmt):
+    from .models import User
+
+    part = path + '.part'
+    with app.app_context():
+        try:
+            user = User.query.get(user_id)
+            with open(part, 'wb') as f:
+                for chunk in generate(user, fmt):
+                    f.write(chunk)
+            os.replace(part, path)
+        except Exception:
+            app.logger.exception('导出用户 %s 的数据失败', user_id)
+            with open(path + '.error', 'w'):
+                pass
+            if os.path.exists(part):
+                os.remove(part)
+        finally:
+            db.session.remove()
+
+
+def cleanup(app):
+    '''删除过期的导出文件'''
+    directory = _directory(app)
+    expires = time.time() - app.config['EXPORT_TTL']
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if os.path.getmtime(path) < expires:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def start_job(user, fmt):
+    '''创建后台导出任务，返回任务的标识；同一个用户同时只能有一个任务在运行'''
+    app = current_app._get_current_object()
+    cleanup(app)
+    if any(job['status'] == 'running' for job in list_jobs(user)):
+        return None
+    token = secrets.token_urlsafe(16)
+    path = job_path(app, user.id, token, fmt)
+    # 先创建 .part 文件，任务开始执行之前状态就是生成中
+    open(path + '.part', 'wb').close()
+    _get_executor(app).submit(_run_job, app, user.id, path, fmt)
+    return token
+
+
+def list_jobs(user):
+    '''用户的导出任务，返回 [{token, format, status, size, created}]'''
+    app = current_app._get_current_object()
+    directory = _directory(app)
+    prefix = '{}-'.format(user.id)
+    # 生成中的文件长时间没有写入，说明执行任务的进程已经被终止
+    stale = time.time() - app.config['EXPORT_STALE_AFTER']
+    jobs = {}
+    for name in os.listdir(directory):
+        if not name.startswith(prefix):
+            continue
+        base, _, suffix = name[len(prefix):].partition('.')
+        fmt, _, state = suffix.partition('.')
+        if fmt not in FORMATS:
+            continue
+        status = {'': 'done', 'part': 'running', 'error': 'failed'}.get(state)
+        if status is None:
+            continue
+        stat = os.stat(os.path.join(directory, name))
+        if status == 'running' and stat.st_mtime < stale:
+            status = 'failed'
+        # 失败的任务可能还留有 .part 文件，以失败为准
+        if jobs.get(base, {}).get('status') == 'failed':
+            continue
+        jobs[base] = {'token': base, 'format': fmt, 'status': status,
+                'size': stat.st_size if status == 'done' else None,
+                'created': datetime.utcfromtimestamp(stat.st_mtime)}
+    return sorted(jobs.values(), key=lambda job: job['created'],
+            reverse=True)
@@ -0,0 +1,143 @@
+'''
+「我关注的人的博客」动态表的维护（写时推送）
+
+用户发布博客时，把这篇博客写入每个粉丝的 feed_items 表，
+读取动态时只需按 user_id 查询这一张表。
+粉丝数量超过 FEED_FANOUT_LIMIT 的作者发布博客时不再推送，
+这类作者的 feed_pull 属性为 True ，粉丝读取动态时直接查询他们的博客。
+关注和取关时同步增删对应作者的动态，数据不一致时用 flask feed rebuild 重建。
+'''
+
+from flask import current_app
+from sqlalchemy import select, and_, or_
+
+from .models import db, User, Blog, Follow, FeedItem
+from .pagination import keyset_paginate
+
+feed_items = FeedItem.__table__
+follows = Follow.__table__
+users = User.__table__
+blogs = Blog.__table__
+
+
+def _is_push_author():
+    '''作者使用写时推送的条件，feed_pull 为空的旧数据视为推送'''
+    return or_(users.c.feed_pull == False, users.c.feed_pull == None)
+
+
+def push_blog(mapper, connection, blog):
+    '''新博客写入数据库后，推送到作者每个粉丝的动态表中'''
+    feed_pull, follower_count = connection.execute(
+            select([users.c.feed_pull, users.c.follower_count])
+            .where(users.c.id == blog.author_id)).first()
+    if feed_pull:
+        return
+    if follower_count > current_app.config['FEED_FANOUT_LIMIT']:
+        # 粉丝太多，改为读取时查询，之前推送过的博客仍然保留
+        connection.execute(users.update().where(users.c.id == blog.author_id)
+                .values(feed_pull=True))
+        return
+    # INSERT ... SELECT 一条语句完成推送，不需要把粉丝列表读到内存中
+    connection.execute(feed_items.insert().from_select(
+        ['user_id', 'blog_id', 'author_id', 'time_stamp'],
+        select([follows.c.follower_id, blogs.c.id, blogs.c.author_id,
+                blogs.c.time_stamp])
+        .select_from(follows.join(blogs,
+                blogs.c.author_id == follows.c.followed_id))
+        .where(blogs.c.id == blog.id)
+    ))
+
+
+def backfill_follow(mapper, connection, follow):
+    '''关注某个用户后，把他最近的博客补充到关注者的动态表中'''
+    feed_pull = connection.execute(select([users.c.feed_pull])
+            .where(users.c.id == follow.followed_id)).scalar()
+    if feed_pull:
+        return
+    recent = select([follows.c.follower_id, blogs.c.id, blogs.c.author_id,
+                blogs.c.time_stamp]) \
+            .select_from(follows.join(blogs,
+                blogs.c.author_id == follows.c.followed_id)) \
+            .where(and_(follows.c.follower_id == follow.follower_id,
+                follows.c.followed_id == follow.followed_id)) \
+            .order_by(blogs.c.time_stamp.desc()) \
+            .limit(current_app.config['FEED_BACKFILL_SIZE'])
+    connection.execute(feed_items.delete().where(and_(
+        feed_items.c.user_id == follow.follower_id,
+        feed_items.c.author_id == follow.followed_id)))
+    connection.execute(feed_items.insert().from_select(
+        ['user_id', 'blog_id', 'author_id', 'time_stamp'], recent))
+
+
+def remove_follow(mapper, connection, follow):
+    '''取关某个用户后，从关注者的动态表中删除他的博客'''
+    connection.execute(feed_items.delete().where(and_(
+        feed_items.c.user_id == follow.follower_id,
+        feed_items.c.author_id == follow.followed_id)))
+
+
+db.event.listen(Blog, 'after_insert', push_blog)
+db.event.listen(Follow, 'after_insert', backfill_follow)
+db.event.listen(Follow, 'after_delete', remove_follow)
+
+
+def read_feed(user, cursor=None, per_page=10):
+    '''
+    分页读取 user 的动态，推送的部分和读取时查询的部分各取一页再合并
+    两部分使用同一个游标，所以合并后的结果仍然是连续的
+    '''
+
+    pushed = keyset_paginate(
+        Blog.timeline().join(FeedItem, FeedItem.blog_id == Blog.id)
+            .filter(FeedItem.user_id == user.id),
+        FeedItem.time_stamp, FeedItem.blog_id, cursor, per_page)
+    pull_authors = [uid for (uid,) in db.session.query(Follow.followed_id)
+            .join(User, User.id == Follow.followed_id)
+            .filter(Follow.follower_id == user.id, User.feed_pull == True)]
+    if not pull_authors:
+        return pushed
+    pulled = keyset_paginate(
+        Blog.timeline().filter(Blog.author_id.in_(pull_authors)),
+        Blog.time_stamp, Blog.id, cursor, per_page)
+    # 作者切换为读取时查询之前推送的博客会在两部分中重复出现
+    merged = {blog.id: blog for blog in pushed.items + pulled.items}
+    items = sorted(merged.values(), key=lambda b: (b.time_stamp, b.id),
+            reverse=True)
+    pushed.items = items[:per_page]
+    pushed.has_next = pushed.has_next or pulled.has_next or \
+            len(items) > per_page
+    return pushed
+
+
+def refresh_pull_flags():
+    '''按当前粉丝数量重新计算每个用户是否使用读取时查询'''
+    db.session.execute(users.update().values(feed_pull=users.c.follower_count
+            > current_app.config['FEED_FANOUT_LIMIT']))
+
+
+def rebuild(user_ids=None, batch_size=100):
+    '''
+    重建动态表，user_ids 为空时重建全部用户
+    每处理 batch_size 个用户提交一次，避免长事务
+    '''
+
+    refresh_pull_flags()
+    db.session.commit()
+    if user_ids is None:
+        user_ids = [uid for (uid,) in db.session.query(User.id)]
+    for i, uid in enumerate(user_ids, 1):
+        db.session.execute(feed_items.delete()
+                .where(feed_items.c.user_id == uid))
+        db.session.execute(feed_items.insert().from_select(
+            ['user_id', 'blog_id', 'author_id', 'time_stamp'],
+            select([follows.c.follower_id, blogs.c.id, blogs.c.author_id,
+                    blogs.c.time_stamp])
+            .select_from(follows
+                .join(blogs, blogs.c.author_id == follows.c.followed_id)
+                .join(users, users.c.id == follows.c.followed_id))
+            .where(and_(follows.c.follower_id == uid, _is_push_author()))
+        ))
+        if i % batch_size == 0:
+            db.session.commit()
+    db.session.commit()
+    return len(user_ids)
@@ -6,6 +6,7 @@ from .models import db, User
 from wtforms import IntegerField, TextAreaField, SelectField, RadioField
 from  flask_login import current_user
 from flask_pagedown.fields import PageDownField
+from flask_wtf.file import FileField, FileAllowed
 
 
 class RegisterForm(FlaskForm):
@@ -44,6 +45,9 @@ class ProfileForm(FlaskForm):
     phone_number = StringField('电话', validators=[Length(6, 16)])
     location = StringField('地址', validators=[Length(2, 16)])
     about_me = TextAreaField('个人简介')
+    # 服务器没有安装 Pillow 时视图中会删除此字段
+    avatar = FileField('头像', validators=[FileAllowed(
+            ['jpg', 'jpeg', 'png', 'gif', 'webp'], '只能上传图片')])
     submit = SubmitField("提交")
 
     def validate_name(self, field):
@@ -82,3 +86,17 @@ class CommentForm(FlaskForm):
 
     body = TextAreaField('', validators=[DataRequired()])
     submit = SubmitField('提交')
+
+
+class ModerateForm(FlaskForm):
+    '''隐藏或恢复评论的表单，只有 CSRF 令牌和按钮'''
+
+    submit = SubmitField('提交')
+
+
+class ExportForm(FlaskForm):
+    """导出博客和评论时选择格式的表单"""
+
+    format = RadioField('格式', choices=[('zip', 'Markdown 文件（zip 压缩包）'),
+            ('ndjson', 'NDJSON（每行一个 JSON 对象）')], default='zip')
+    submit = SubmitField('导出')
@@ -0,0 +1,146 @@
+'''
+关注关系的缓存和批量查询
+
+每个用户「关注了谁」的 ID 集合查询一次后缓存在进程内，
+判断关注关系时直接查集合，给一组用户渲染关注按钮也只需要一次查询。
+关注和取关时更新 User 中冗余存储的关注数和粉丝数，事务提交之后清除关注者的缓存；
+其他进程中的缓存最多在 FOLLOW_GRAPH_TTL 秒之后失效。
+'''
+
+import threading
+import time
+from collections import OrderedDict
+
+from .models import db, User, Follow
+from . import stats, identity
+from .pagination import keyset_paginate
+
+
+class FollowGraph:
+    '''用户 ID 到其关注的用户 ID 集合的缓存'''
+
+    def __init__(self, ttl=60, maxsize=10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config['FOLLOW_GRAPH_TTL']
+        self.maxsize = app.config['FOLLOW_GRAPH_SIZE']
+
+    def following_set(self, user_id):
+        '''user_id 关注的所有用户的 ID 集合'''
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._data.move_to_end(user_id)
+                return entry[1]
+        ids = frozenset(uid for (uid,) in db.session.query(Follow.followed_id)
+                .filter(Follow.follower_id == user_id))
+        with self._lock:
+            self._data[user_id] = (now + self.ttl, ids)
+            self._data.move_to_end(user_id)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return ids
+
+    def is_following(self, user_id, other_id):
+        return other_id in self.following_set(user_id)
+
+    def is_following_many(self, user_id, other_ids):
+        '''返回 {用户 ID: user_id 是否关注了该用户} 的字典'''
+        following = self.following_set(user_id)
+        return {other_id: other_id in following for other_id in other_ids}
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._data.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+graph = FollowGraph()
+
+
+def _change_counts(connection, follow, delta):
+    stats.change(connection, follow.follower_id, followed_count=delta)
+    stats.change(connection, follow.followed_id, follower_count=delta)
+    # 提交之前其他请求仍然可能读到旧的关注关系并放回缓存，提交之后再清除
+    session = db.object_session(follow)
+    if session is not None:
+        session.info.setdefault('graph_pending', set()).add(
+                follow.follower_id)
+    else:
+        graph.invalidate(follow.follower_id)
+    # 缓存的登录用户中也保存了关注数和粉丝数
+    identity.invalidate_later(follow, follow.follower_id, follow.followed_id)
+
+
+def on_follow(mapper, connection, follow):
+    _change_counts(connection, follow, 1)
+
+
+def on_unfollow(mapper, connection, follow):
+    _change_counts(connection, follow, -1)
+
+
+def apply_pending(session):
+    for user_id in session.info.pop('graph_pending', ()):
+        graph.invalidate(user_id)
+
+
+def discard_pending(session, *args):
+    session.info.pop('graph_pending', None)
+
+
+db.event.listen(Follow, 'after_insert', on_follow)
+db.event.listen(Follow, 'after_delete', on_unfollow)
+db.event.listen(db.session, 'after_commit', apply_pending)
+db.event.listen(db.session, 'after_rollback', discard_pending)
+
+
+def _load_user(relationship, with_stats):
+    option = db.joinedload(relationship)
+    return option.joinedload(User.stats) if with_stats else option
+
+
+def followers_page(user, cursor=None, per_page=10, with_stats=False):
+    '''
+    user 的粉丝列表，按关注时间倒序游标分页
+    关注者通过联结查询一并加载，with_stats 为 True 时同时加载博客数等统计数据；
+    被关注者都是 user ，已经在会话中，不需要再联结
+    '''
+
+    query = Follow.query.filter(Follow.followed_id == user.id).options(
+            _load_user(Follow.follower, with_stats),
+            db.lazyload(Follow.followed))
+    return keyset_paginate(query, Follow.time_stamp, Follow.follower_id,
+            cursor, per_page, key_func=lambda f: (f.time_stamp, f.follower_id))
+
+
+def followed_page(user, cursor=None, per_page=10, with_stats=False):
+    '''user 关注的用户列表，按关注时间倒序游标分页'''
+    query = Follow.query.filter(Follow.follower_id == user.id).options(
+            _load_user(Follow.followed, with_stats),
+            db.lazyload(Follow.follower))
+    return keyset_paginate(query, Follow.time_stamp, Follow.followed_id,
+            cursor, per_page, key_func=lambda f: (f.time_stamp, f.followed_id))
+
+
+def recount():
+    '''根据 follows 表重新计算每个用户的关注数和粉丝数'''
+    users = User.__table__
+    follows = Follow.__table__
+    followed = db.select([db.func.count()]).select_from(follows) \
+            .where(follows.c.follower_id == users.c.id).as_scalar()
+    followers = db.select([db.func.count()]).select_from(follows) \
+            .where(follows.c.followed_id == users.c.id).as_scalar()
+    db.session.execute(users.update().values(followed_count=followed,
+            follower_count=followers))
+    db.session.commit()
+    graph.clear()
+    identity.cache.clear()
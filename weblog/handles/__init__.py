@@ -1,5 +1,8 @@
 from .front import front
 from .user import user
+from .metrics import metrics
+from .api import api
+from .avatars import avatars
 
-blueprint_list = [front, user]
+blueprint_list = [front, user, metrics, api, avatars]
 
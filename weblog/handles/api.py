@@ -0,0 +1,263 @@
+'''
+JSON 格式的 API ，供移动客户端使用
+
+- 列表使用游标分页，响应中的 next_cursor 为空表示没有下一页；热门博客只有一页
+- ?fields=id,body_html 只返回指定的字段，没有请求的字段不会计算
+- 安装了 orjson 时用它序列化，否则使用标准库的 json
+- 按 Accept-Encoding 使用 brotli（需要安装 brotli）或 gzip 压缩
+- 响应带有 ETag ，客户端带着 If-None-Match 再次请求时，内容没有变化就返回 304
+'''
+
+import gzip
+import hashlib
+import json
+
+from flask import Blueprint, current_app, request, url_for, abort
+from flask_login import current_user
+from werkzeug.exceptions import HTTPException
+
+from ..models import db, User, Blog
+from ..pagination import keyset_paginate
+from ..comments import comments_page
+from ..graph import followers_page, followed_page
+from ..feed import read_feed
+from ..hot import hot_blogs, ranking
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+def dumps(obj):
+    '''序列化为 UTF-8 编码的 JSON'''
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def _iso(value):
+    return value.isoformat() if value is not None else None
+
+
+def _author(obj):
+    return {'id': obj.author.id, 'name': obj.author.name}
+
+
+# 每种数据可以返回的字段，值为从实例中取出该字段的函数
+BLOG_FIELDS = {
+    'id': lambda b: b.id,
+    'body': lambda b: b.body,
+    'body_html': lambda b: b.body_html,
+    'time_stamp': lambda b: _iso(b.time_stamp),
+    'updated_at': lambda b: _iso(b.updated_at),
+    'comment_count': lambda b: b.comment_count,
+    'author': _author,
+    'url': lambda b: url_for('front.blog', id=b.id),
+}
+
+# 热门博客另外返回现在的热度
+HOT_BLOG_FIELDS = dict(BLOG_FIELDS, hot=lambda b: ranking.current(b.id))
+
+COMMENT_FIELDS = {
+    'id': lambda c: c.id,
+    'body': lambda c: c.body,
+    'time_stamp': lambda c: _iso(c.time_stamp),
+    'author': _author,
+}
+
+USER_FIELDS = {
+    'id': lambda u: u.id,
+    'name': lambda u: u.name,
+    'about_me': lambda u: u.about_me,
+    'location': lambda u: u.location,
+    'created_at': lambda u: _iso(u.created_at),
+    'last_seen': lambda u: _iso(u.last_seen),
+    'blog_count': lambda u: u.blog_count,
+    'followed_count': lambda u: u.followed_count,
+    'follower_count': lambda u: u.follower_count,
+    'comment_count': lambda u: u.comment_count,
+    'url': lambda u: url_for('user.index', name=u.name),
+}
+
+# 关注列表中的每一项是 Follow 实例，字段为对方用户的字段加上关注时间
+FOLLOWER_FIELDS = dict({k: (lambda f, get=v: get(f.follower))
+        for k, v in USER_FIELDS.items()},
+        followed_at=lambda f: _iso(f.time_stamp))
+FOLLOWED_FIELDS = dict({k: (lambda f, get=v: get(f.followed))
+        for k, v in USER_FIELDS.items()},
+        followed_at=lambda f: _iso(f.time_stamp))
+
+
+def requested_fields(available):
+    '''解析 ?fields= 参数，返回要输出的字段名列表'''
+    fields = request.args.get('fields')
+    if not fields:
+        return list(available)
+    names = [name.strip() for name in fields.split(',') if name.strip()]
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        abort(400, '未知的字段：{}，可用的字段：{}'.format(', '.join(unknown),
+                ', '.join(available)))
+    return names
+
+
+def serialize(obj, available, fields):
+    return {name: available[name](obj) for name in fields}
+
+
+def json_response(data, status=200):
+    '''生成 JSON 响应，处理条件请求和压缩'''
+    body = dumps(data)
+    response = current_app.response_class(body, status=status,
+            mimetype='application/json')
+    if status != 200:
+        return response
+    # 压缩后的内容与原始内容不同，所以使用弱 ETag
+    response.set_etag(hashlib.md5(body).hexdigest(), weak=True)
+    # 客户端每次都要带着 ETag 验证；登录用户的数据不能被共享缓存保存
+    response.cache_control.no_cache = True
+    if current_user.is_authenticated:
+        response.cache_control.private = True
+    response.vary.add('Cookie')
+    response = response.make_conditional(request)
+    if response.status_code == 304:
+        return response
+    return compress(response)
+
+
+def compress(response):
+    '''按 Accept-Encoding 压缩响应，内容太短时不压缩'''
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < current_app.config['API_COMPRESS_MIN_SIZE']:
+        return response
+    offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+    encoding = request.accept_encodings.best_match(offered)
+    if encoding == 'br':
+        body = brotli.compress(body,
+                quality=current_app.config['API_BROTLI_QUALITY'])
+    elif encoding == 'gzip':
+        body = gzip.compress(body, current_app.config['API_GZIP_LEVEL'])
+    else:
+        return response
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def per_page():
+    count = request.args.get('per_page', type=int) or \
+            current_app.config['API_PER_PAGE']
+    return max(1, min(count, current_app.config['API_MAX_PER_PAGE']))
+
+
+def page_response(pagination, available):
+    '''一页列表数据的响应，next 为下一页的地址'''
+    fields = requested_fields(available)
+    next_cursor = pagination.next_cursor
+    next_url = None
+    if next_cursor:
+        args = dict(request.view_args, **request.args.to_dict())
+        args['cursor'] = next_cursor
+        next_url = url_for(request.endpoint, **args)
+    return json_response({
+        'items': [serialize(item, available, fields)
+                  for item in pagination.items],
+        'next_cursor': next_cursor,
+        'next': next_url,
+    })
+
+
+@api.errorhandler(HTTPException)
+def http_error(e):
+    '''API 中的错误也以 JSON 格式返回'''
+    return json_response({'error': e.description}, e.code)
+
+
+def get_user(name):
+    user = User.query.options(db.joinedload(User.stats)).filter_by(
+            name=name).first()
+    if user is None:
+        abort(404, '用户 {} 不存在'.format(name))
+    return user
+
+
+@api.route('/blogs')
+def blogs():
+    '''全站博客的时间线'''
+    pagination = keyset_paginate(Blog.timeline(), Blog.time_stamp, Blog.id,
+            request.args.get('cursor'), per_page())
+    return page_response(pagination, BLOG_FIELDS)
+
+
+@api.route('/blogs/hot')
+def hot_blogs_list():
+    '''热门博客，按热度从高到低排列，?per_page= 指定数量，不分页'''
+    fields = requested_fields(HOT_BLOG_FIELDS)
+    return json_response({'items': [serialize(blog, HOT_BLOG_FIELDS, fields)
+            for blog in hot_blogs(per_page())]})
+
+
+@api.route('/blogs/<int:id>')
+def blog(id):
+    blog = Blog.query.options(db.joinedload(Blog.author)).get(id)
+    if blog is None:
+        abort(404, '博客不存在')
+    return json_response(serialize(blog, BLOG_FIELDS,
+            requested_fields(BLOG_FIELDS)))
+
+
+@api.route('/blogs/<int:id>/comments')
+def blog_comments(id):
+    '''博客的评论，不包含被隐藏的评论'''
+    blog = Blog.query.get(id)
+    if blog is None:
+        abort(404, '博客不存在')
+    pagination = comments_page(blog, request.args.get('cursor'), per_page())
+    return page_response(pagination, COMMENT_FIELDS)
+
+
+@api.route('/users/<name>')
+def user(name):
+    return json_response(serialize(get_user(name), USER_FIELDS,
+            requested_fields(USER_FIELDS)))
+
+
+@api.route('/users/<name>/blogs')
+def user_blogs(name):
+    user = get_user(name)
+    pagination = keyset_paginate(Blog.query.filter(Blog.author_id == user.id),
+            Blog.time_stamp, Blog.id, request.args.get('cursor'), per_page())
+    return page_response(pagination, BLOG_FIELDS)
+
+
+@api.route('/users/<name>/followers')
+def followers(name):
+    pagination = followers_page(get_user(name), request.args.get('cursor'),
+            per_page(), with_stats=True)
+    return page_response(pagination, FOLLOWER_FIELDS)
+
+
+@api.route('/users/<name>/followed')
+def followed(name):
+    pagination = followed_page(get_user(name), request.args.get('cursor'),
+            per_page(), with_stats=True)
+    return page_response(pagination, FOLLOWED_FIELDS)
+
+
+@api.route('/feed')
+def feed():
+    '''当前登录用户关注的人的博客'''
+    if not current_user.is_authenticated:
+        abort(401, '需要登录')
+    pagination = read_feed(current_user, request.args.get('cursor'),
+            per_page())
+    return page_response(pagination, BLOG_FIELDS)
@@ -0,0 +1,34 @@
+'''
+用户头像的图片
+'''
+
+import os
+import re
+
+from flask import Blueprint, abort, current_app, send_file
+
+from ..avatars import store, IDENTICON_HASH_LENGTH
+from ..models import db, User
+
+avatars = Blueprint('avatars', __name__)
+
+_DIGEST = re.compile(r'^[0-9a-f]{32,40}$')
+
+
+@avatars.route('/avatars/<digest>/<int:size>')
+def avatar(digest, size):
+    '''头像文件，同一个地址的内容不会变化，浏览器可以一直缓存'''
+    if size not in store.sizes or not _DIGEST.match(digest):
+        abort(404)
+    path = store.path(digest, size)
+    if not os.path.exists(path):
+        # 上传的图片不能重新生成；identicon 还没有在后台生成好时在这里生成，
+        # 只生成属于某个用户的哈希，任意的哈希不能让服务器写入文件
+        if len(digest) != IDENTICON_HASH_LENGTH or not db.session.query(
+                User.query.filter_by(avatar_hash=digest).exists()).scalar():
+            abort(404)
+        store.generate(digest)
+    response = send_file(path, mimetype='image/png', conditional=True)
+    response.headers['Cache-Control'] = 'public, max-age={}, immutable' \
+            .format(current_app.config['AVATAR_MAX_AGE'])
+    return response
@@ -3,7 +3,15 @@ from flask import render_template, current_app, make_response
 from  flask_login import login_required, login_user, logout_user, current_user
 from datetime import datetime
 from ..forms import RegisterForm, LoginForm, BlogForm, CommentForm
+from ..forms import ModerateForm
 from ..models import db, User, Blog, Comment, Permission
+from ..pagination import keyset_paginate
+from .. import search as searcher
+from ..cache import page_cache
+from ..comments import comments_page
+from ..passwords import login_limiter
+from ..streaming import render_list
+from ..hot import hot_blogs
 
 
 # 创建蓝图
@@ -20,6 +28,7 @@ def inter_server_error(e):
     return render_template('500.html'), 500
 
 @front.route('/', methods=["GET", 'POST'])
+@page_cache.cached_page(scopes=('listing',))
 def index():
     '''网站首页'''
     form = BlogForm()
@@ -32,11 +41,22 @@ def index():
             db.session.commit()
             flash('成功发布博客', 'success')
             return redirect(url_for('.index'))
-    blogs = Blog.query.order_by(Blog.time_stamp.desc())
-    return render_template('index.html', form=form, blogs=blogs)
+    # 使用游标分页，翻页时不需要 OFFSET 和 COUNT(*)
+    pagination = keyset_paginate(Blog.timeline(), Blog.time_stamp, Blog.id,
+            cursor=request.args.get('cursor'),
+            per_page=current_app.config['BLOGS_PER_PAGE'])
+    return render_list('index.html', form=form, blogs=pagination.items,
+            pagination=pagination)
     # date_time = datetime.utcnow()
     # print("1111111111111111111: %s"%date_time)
     # return render_template('index.html', date_time=date_time)
+@front.route('/hot')
+@page_cache.cached_page(scopes=('hot',))
+def hot():
+    '''热门博客，直接读取内存中的排行'''
+    blogs = hot_blogs(current_app.config['HOT_BLOGS_PER_PAGE'])
+    return render_template('hot.html', blogs=blogs)
+
 @front.route('/register', methods=['POST', 'GET'])
 def register():
     """用户注册"""
@@ -57,11 +77,29 @@ def login():
         flash('你已经处于登录状态', 'success')
     form = LoginForm()
     if form.validate_on_submit():
+        # 失败次数过多时直接拒绝，不再计算密码哈希
+        window = current_app.config['LOGIN_ATTEMPT_WINDOW']
+        limits = [
+            ('ip:{}'.format(request.remote_addr),
+                current_app.config['LOGIN_ATTEMPTS_PER_IP']),
+            ('email:{}'.format(form.email.data.lower()),
+                current_app.config['LOGIN_ATTEMPTS_PER_EMAIL']),
+        ]
+        wait = max(login_limiter.blocked_for(key, limit, window)
+                for key, limit in limits)
+        if wait:
+            flash('登录失败次数过多，请 {} 秒后再试'.format(wait), 'warning')
+            return render_template('login.html', form=form), 429
         user = User.query.filter_by(email=form.email.data).first()
         if user and user.verify_password(form.password.data):
+            login_limiter.reset(limits[1][0])
+            # 保存 verify_password 中按新参数重新计算的哈希
+            db.session.commit()
             login_user(user, form.remember_me.data)
             flash('你已经登录成功， {}'.format(user.name), 'success')
             return redirect(url_for('.index'))
+        for key, limit in limits:
+            login_limiter.hit(key, window)
         flash('邮箱或密码错误', 'warning')
     return render_template('login.html', form=form)
 
@@ -71,7 +109,7 @@ def logout():
     logout_user()
     flash('你已经退出登录', 'info')
     return redirect(url_for('.index'))
-@front.before_app_first_request
+@front.before_app_request
 def before_request():
     '''页面请求预处理'''
     if current_user.is_authenticated:
@@ -79,26 +117,67 @@ def before_request():
 
 
 @front.route('/blog/<int:id>', methods=['GET', 'POST'])
+@page_cache.cached_page(scopes=('blog:{id}',))
 def blog(id):
     '''每篇博客的单独页面，便于分享'''
-    blog = Blog.query.get_or_404(id)
+    blog = Blog.query.options(db.joinedload(Blog.author)).get_or_404(id)
     # 页面提供评论输入框
     form = CommentForm()
-    if form.validate_on_submit():
+    if current_user.is_authenticated and form.validate_on_submit():
         comment = Comment(body=form.body.data, blog=blog, author=current_user)
         db.session.add(comment)
         db.session.commit()
         flash('评论成功。', 'success')
         return redirect(url_for('.blog', id=id))
-    page = request.args.get('page', default=1, type=int)
-    pagination = blog.comments.order_by(Comment.time_stamp.desc()).paginate(
-            page,
-            per_page = current_app.config['COMMENTS_PER_PAGE'],
-            error_out = False
-    )
+    # 协管员可以看到被隐藏的评论，只判断一次，不在模板中逐条判断
+    moderate = bool(current_user.is_authenticated and current_user.is_moderator)
+    pagination = comments_page(blog, request.args.get('cursor'),
+            current_app.config['COMMENTS_PER_PAGE'], moderate)
     comments = pagination.items
     # hidebloglink 在博客页面中隐藏博客单独页面的链接
     # noblank 在博客页面中点击编辑按钮不在新标签页中打开
+    # 隐藏和恢复评论的按钮共用一个只带 CSRF 令牌的表单
+    moderate_form = ModerateForm() if moderate else None
     return render_template('blog.html', blogs=[blog], hidebloglink=True,
             noblank=True, form=form, pagination=pagination,
-            comments=comments, Permission=Permission)
\ No newline at end of file
+            comments=comments, moderate=moderate,
+            moderate_form=moderate_form, Permission=Permission)
+
+
+def moderate_comment(id, disable):
+    '''隐藏或恢复评论，只有协管员可以操作'''
+    if not current_user.is_moderator:
+        abort(403)
+    # 修改状态只接受带 CSRF 令牌的 POST 请求
+    if not ModerateForm().validate_on_submit():
+        abort(400)
+    comment = Comment.query.get_or_404(id)
+    comment.disable = disable
+    db.session.add(comment)
+    db.session.commit()
+    return redirect(url_for('.blog', id=comment.blog_id))
+
+@front.route('/comment/<int:id>/disable', methods=['POST'])
+@login_required
+def disable_comment(id):
+    '''隐藏评论'''
+    return moderate_comment(id, True)
+
+@front.route('/comment/<int:id>/enable', methods=['POST'])
+@login_required
+def enable_comment(id):
+    '''恢复被隐藏的评论'''
+    return moderate_comment(id, False)
+
+@front.route('/search')
+def search():
+    '''搜索博客和用户'''
+    q = request.args.get('q', '').strip()
+    doc_type = request.args.get('type', 'blog')
+    if doc_type not in ('blog', 'user'):
+        abort(404)
+    page = request.args.get('page', default=1, type=int)
+    result = searcher.search(q, doc_type, page,
+            current_app.config['SEARCH_RESULTS_PER_PAGE'])
+    return render_template('search.html', q=q, doc_type=doc_type,
+            result=result, blogs=result.items if doc_type == 'blog' else [])
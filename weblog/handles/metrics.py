@@ -0,0 +1,20 @@
+'''
+以 Prometheus 文本格式输出统计数据
+'''
+
+from flask import Blueprint, abort, current_app, request
+
+from ..metrics import metrics as registry
+
+metrics = Blueprint('metrics', __name__)
+
+@metrics.route('/metrics')
+def index():
+    '''各视图的请求耗时、SQL 次数和耗时、模板渲染耗时等统计数据'''
+    if not current_app.config['METRICS_ENABLED']:
+        abort(404)
+    # 统计数据中有各个视图的访问量，只对监控系统所在的地址开放
+    if request.remote_addr not in current_app.config['METRICS_ALLOWED_ADDRS']:
+        abort(404)
+    return registry.expose(), 200, {
+        'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
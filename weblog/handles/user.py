@@ -4,30 +4,60 @@
 
 from datetime import datetime
 from flask import Blueprint, abort, redirect, url_for, flash, render_template
-from flask import request, current_app
+from flask import request, current_app, send_file, stream_with_context
 from flask_login import login_required, login_user, current_user
 
 from ..models import db, User, Role, Blog, Permission
-from ..forms import ProfileForm, ChangePasswordForm, BlogForm
+from ..forms import ProfileForm, ChangePasswordForm, BlogForm, ExportForm
+from ..graph import graph, followers_page, followed_page
+from ..cache import page_cache
+from ..streaming import render_list
+from ..pagination import keyset_paginate
+from ..avatars import store as avatar_store
+from ..export import FORMATS, generate, filename, start_job, list_jobs
+from ..export import job_path, disposition
+from ..routing import primary_only
 
 user = Blueprint('user', __name__, url_prefix='/user')
 
 @user.route('/<name>/index')
+@page_cache.cached_page(scopes=('user:{name}',))
 def index(name):
     '''用户的个人主页'''
-    user = User.query.filter_by(name=name).first()
+    user = User.query.options(db.joinedload(User.stats)).filter_by(
+            name=name).first()
     if not user:
         abort(404)
-    blogs = user.blogs.order_by(Blog.time_stamp.desc())
-
-    return render_template('user/index.html', user=user, blogs=blogs)
+    # 作者就是 user ，已经在会话中，渲染博客时不会再查询作者
+    pagination = keyset_paginate(user.blogs, Blog.time_stamp, Blog.id,
+            request.args.get('cursor'), current_app.config['BLOGS_PER_PAGE'])
+    return render_list('user/index.html', user=user, blogs=pagination.items,
+            pagination=pagination)
 
 @user.route('/edit-profile', methods=["GET", 'POST'])
 @login_required
 def edit_profile():
     '''用户编辑自己的个人信息'''
     form = ProfileForm(current_user, obj=current_user)
+    if not avatar_store.can_upload:
+        del form.avatar
     if form.validate_on_submit():
+        if 'avatar' in form:
+            if form.avatar.data:
+                limit = current_app.config['AVATAR_MAX_UPLOAD']
+                data = form.avatar.data.read(limit + 1)
+                try:
+                    if len(data) > limit:
+                        raise ValueError('图片不能超过 {} KB'.format(
+                                limit // 1024))
+                    # 缩放在进程池中完成，各种尺寸的文件保存之后才返回
+                    current_user.avatar_hash = avatar_store.upload(data)
+                except ValueError as e:
+                    form.avatar.errors.append(str(e))
+                    return render_template('user/edit_profile.html',
+                            form=form)
+            # 头像已经单独处理，不交给 populate_obj
+            del form.avatar
         form .populate_obj(current_user)
         db.session.add(current_user)
         db.session.commit()
@@ -66,6 +96,7 @@ def edit_blog(id):
     return render_template('user/edit_blog.html', form=form)
 
 @user.route('/follow/<name>')
+@primary_only
 @login_required
 def follow(name):
     '''关注用户'''
@@ -73,15 +104,16 @@ def follow(name):
     if not user:
         flash('该用户不存在。', 'warning')
         return redirect(url_for('front.index'))
-    if current_user.is_following(user):
-        flash('在此操作之前，你已经关注了该用户。', 'info')
-    else:
-        current_user.follow(user)
+    # 是否已经关注以数据库为准，不读进程内的缓存
+    if current_user.follow(user):
         flash('成功关注此用户。', 'success')
+    else:
+        flash('在此操作之前，你已经关注了该用户。', 'info')
     return redirect(url_for('.index', name=name))
 
 
 @user.route('/unfollow/<name>')
+@primary_only
 @login_required
 def unfollow(name):
     '''取关用户'''
@@ -89,13 +121,21 @@ def unfollow(name):
     if not user:
         flash('该用户不存在。', 'warning')
         return redirect(url_for('front.index'))
-    if not current_user.is_following(user):
-        flash('你并未关注此用户。', 'info')
-    else:
-        current_user.unfollow(user)
+    if current_user.unfollow(user):
         flash('成功取关此用户。', 'success')
+    else:
+        flash('你并未关注此用户。', 'info')
     return redirect(url_for('.index', name=name))
 
+def mark_following(follows):
+    '''标记当前登录用户是否关注了列表中的每个用户，整个列表只查询一次'''
+    if not current_user.is_authenticated:
+        return
+    following = graph.is_following_many(current_user.id,
+            [f['user'].id for f in follows])
+    for f in follows:
+        f['following'] = following[f['user'].id]
+
 @user.route('/<name>/followed')
 def followed(name):
     '''【user 关注了哪些用户】的页面'''
@@ -103,17 +143,16 @@ def followed(name):
     if not user:
         flash('用户不存在。', 'warning')
         return redirect(url_for('front.index'))
-    page = request.args.get('page', default=1, type=int)
-    pagination = user.followed.paginate(
-            page,
-            per_page = current_app.config['USERS_PER_PAGE'],
-            error_out = False
-    )
+    # 游标分页，总数直接使用 User 中冗余存储的关注数，不执行 COUNT(*)
+    pagination = followed_page(user, request.args.get('cursor'),
+            current_app.config['USERS_PER_PAGE'])
     follows = [{'user': f.followed, 'time_stamp': f.time_stamp}
             for f in pagination.items]
+    mark_following(follows)
     # 这个模板是「关注了哪些用户」和「被哪些用户关注了」共用的模板
     return render_template('user/follow.html', user=user, title='我关注的人',
-            endpoint='user.followed', pagination=pagination, follows=follows)
+            endpoint='user.followed', pagination=pagination, follows=follows,
+            total=user.followed_count)
 
 
 @user.route('/<name>/followers')
@@ -123,13 +162,52 @@ def followers(name):
     if not user:
         flash('用户不存在。', 'warning')
         return redirect(url_for('front.index'))
-    page = request.args.get('page', default=1, type=int)
-    pagination = user.followers.paginate(
-            page,
-            per_page = current_app.config['USERS_PER_PAGE'],
-            error_out = False
-    )
+    pagination = followers_page(user, request.args.get('cursor'),
+            current_app.config['USERS_PER_PAGE'])
     follows = [{'user': f.follower, 'time_stamp': f.time_stamp}
             for f in pagination.items]
+    mark_following(follows)
     return render_template('user/follow.html', user=user, title='关注我的人',
-            endpoint='user.followers', pagination=pagination, follows=follows)
\ No newline at end of file
+            endpoint='user.followers', pagination=pagination, follows=follows,
+            total=user.follower_count)
+
+@user.route('/export', methods=['GET', 'POST'])
+@login_required
+def export():
+    '''
+    导出自己的博客和评论：博客不多时直接流式下载，
+    否则在后台生成文件，生成好之后在此页面下载
+    '''
+    form = ExportForm()
+    if form.validate_on_submit():
+        fmt = form.format.data
+        user = current_user._get_current_object()
+        if user.blog_count <= current_app.config['EXPORT_SYNC_LIMIT']:
+            response = current_app.response_class(
+                    stream_with_context(generate(user, fmt)),
+                    mimetype=FORMATS[fmt])
+            response.headers.set('Content-Disposition', 'attachment',
+                    **disposition(filename(user, fmt)))
+            return response
+        if start_job(user, fmt) is None:
+            flash('已经有一个导出任务正在进行', 'warning')
+        else:
+            flash('正在后台导出，完成后可以在本页面下载', 'info')
+        return redirect(url_for('.export'))
+    return render_template('user/export.html', form=form,
+            jobs=list_jobs(current_user))
+
+@user.route('/export/files/<token>')
+@login_required
+def export_file(token):
+    '''下载后台导出的文件，支持 Range 请求，中断后可以续传'''
+    for job in list_jobs(current_user):
+        if job['token'] == token and job['status'] == 'done':
+            break
+    else:
+        abort(404)
+    path = job_path(current_app, current_user.id, token, job['format'])
+    return send_file(path, mimetype=FORMATS[job['format']],
+            as_attachment=True,
+            attachment_filename=filename(current_user, job['format']),
+            conditional=True)
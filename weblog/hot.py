@@ -0,0 +1,272 @@
+'''
+热门博客排行
+
+每篇博客的热度是各次事件权重的和，每个事件的贡献按 HOT_HALF_LIFE 秒的半衰期指数衰减：
+- 发布博客：HOT_POST_WEIGHT ，作者的粉丝越多初始热度越高
+- 新的可见评论：HOT_COMMENT_WEIGHT ，评论被隐藏或删除时减去
+- 有人关注作者：作者最新的一篇博客加上 HOT_FOLLOW_WEIGHT
+
+Blog.hot_score 存储热度对数化之后的值 log2(Σ 权重 * 2 ** (事件时间 / 半衰期)) 。
+所有博客按同样的速度衰减，衰减不会改变排名，所以不需要定期重写全部博客的得分，
+数值随时间线性增长也不会溢出；当前的热度是 2 ** (hot_score - 现在 / 半衰期) 。
+得分在触发事件的同一个事务中用行锁读出、计算并写回，不需要按评论 GROUP BY 。
+
+每个进程在内存中保存得分最高的 HOT_CAPACITY 篇博客的有序列表：
+- 本进程中的事务提交后直接更新列表
+- 其他进程写入的得分每隔 HOT_REFRESH_INTERVAL 秒按 hot_score 索引重新读取一次
+- 读取前 N 篇只需要切片，不查询数据库
+'''
+
+import bisect
+import math
+import threading
+import time
+
+from .models import db, User, Blog, Comment, Follow
+
+blogs = Blog.__table__
+
+
+def combine(score, weight, when, half_life):
+    '''把 when 时刻（Unix 时间戳）权重为 weight 的事件加到对数得分 score 上'''
+    event = when / half_life
+    if score is None:
+        return event + math.log2(weight) if weight > 0 else None
+    top = max(score, event)
+    total = 2 ** (score - top) + weight * 2 ** (event - top)
+    # 减去事件之后可能因为舍入误差剩下极小的值，当作没有热度
+    if total <= 1e-9:
+        return None
+    return top + math.log2(total)
+
+
+def _timestamp(value):
+    return value.timestamp() if value is not None else time.time()
+
+
+class HotRanking:
+    '''得分最高的博客，按得分从高到低排列'''
+
+    def __init__(self, capacity=1000, refresh_interval=60,
+            half_life=12 * 3600):
+        self.capacity = capacity
+        self.refresh_interval = refresh_interval
+        self.half_life = half_life
+        self.weights = {'post': 1.0, 'comment': 1.0, 'follow': 0.5}
+        self._scores = {}       # {博客 ID: 得分}
+        self._ranked = []       # [(-得分, 博客 ID)] ，升序即得分从高到低
+        self._loaded = None     # 上次从数据库读取的时间
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.capacity = app.config['HOT_CAPACITY']
+        self.refresh_interval = app.config['HOT_REFRESH_INTERVAL']
+        self.half_life = app.config['HOT_HALF_LIFE']
+        self.weights = {
+            'post': app.config['HOT_POST_WEIGHT'],
+            'comment': app.config['HOT_COMMENT_WEIGHT'],
+            'follow': app.config['HOT_FOLLOW_WEIGHT'],
+        }
+
+    def _remove(self, blog_id):
+        score = self._scores.pop(blog_id, None)
+        if score is not None:
+            index = bisect.bisect_left(self._ranked, (-score, blog_id))
+            del self._ranked[index]
+
+    def update(self, blog_id, score):
+        '''设置一篇博客的得分，score 为 None 表示移出排行'''
+        with self._lock:
+            self._remove(blog_id)
+            if score is None:
+                return
+            entry = (-score, blog_id)
+            # 已满时低于最后一名的博客不进入列表
+            if len(self._ranked) >= self.capacity and \
+                    entry > self._ranked[-1]:
+                return
+            bisect.insort(self._ranked, entry)
+            self._scores[blog_id] = score
+            if len(self._ranked) > self.capacity:
+                _, last = self._ranked.pop()
+                del self._scores[last]
+
+    def refresh(self, force=False):
+        '''到了时间时从数据库重新读取前 HOT_CAPACITY 篇，返回是否读取了'''
+        now = time.monotonic()
+        with self._lock:
+            if not force and self._loaded is not None and \
+                    now - self._loaded < self.refresh_interval:
+                return False
+            # 先记下时间，其他线程不再重复读取
+            self._loaded = now
+        rows = db.session.query(Blog.id, Blog.hot_score).filter(
+                Blog.hot_score != None).order_by(Blog.hot_score.desc(),
+                Blog.id.desc()).limit(self.capacity).all()
+        ranked = sorted((-score, blog_id) for blog_id, score in rows)
+        with self._lock:
+            self._ranked = ranked
+            self._scores = {blog_id: -score for score, blog_id in ranked}
+        return True
+
+    def top(self, n):
+        '''得分最高的 n 篇博客的 ID'''
+        self.refresh()
+        with self._lock:
+            return [blog_id for _, blog_id in self._ranked[:n]]
+
+    def current(self, blog_id):
+        '''博客现在的热度（已经衰减），不在排行中时为 None'''
+        with self._lock:
+            score = self._scores.get(blog_id)
+        if score is None:
+            return None
+        return 2 ** (score - time.time() / self.half_life)
+
+    def clear(self):
+        with self._lock:
+            self._ranked = []
+            self._scores = {}
+            self._loaded = None
+
+
+ranking = HotRanking()
+
+
+def hot_blogs(n):
+    '''得分最高的 n 篇博客，作者通过联结查询一并加载'''
+    ids = ranking.top(n)
+    if not ids:
+        return []
+    found = {blog.id: blog for blog in
+             Blog.timeline().filter(Blog.id.in_(ids))}
+    # 内存中的排行可能包含刚被删除的博客
+    return [found[blog_id] for blog_id in ids if blog_id in found]
+
+
+def _pending(target, blog_id, score):
+    '''记下得分的变化，事务提交之后再更新内存中的排行'''
+    session = db.inspect(target).session
+    if session is not None:
+        session.info.setdefault('hot_pending', {})[blog_id] = score
+
+
+def _bump(connection, target, blog_id, weight, when):
+    '''在触发事件的事务中更新一篇博客的得分'''
+    row = connection.execute(db.select([blogs.c.hot_score]).where(
+            blogs.c.id == blog_id).with_for_update()).first()
+    if row is None:
+        return
+    score = combine(row.hot_score, weight, when, ranking.half_life)
+    # 得分不影响博客的显示，保持 updated_at 不变，不让 HTML 片段缓存失效
+    connection.execute(blogs.update().where(blogs.c.id == blog_id).values(
+            hot_score=score, updated_at=blogs.c.updated_at))
+    _pending(target, blog_id, score)
+
+
+def post_weight(follower_count):
+    return ranking.weights['post'] * (1 + math.log2(1 + follower_count))
+
+
+def on_blog_insert(mapper, connection, blog):
+    '''发布时的初始得分随插入语句一起写入'''
+    followers = connection.execute(db.select([User.follower_count])
+            .where(User.id == blog.author_id)).scalar() or 0
+    blog.hot_score = combine(None, post_weight(followers),
+            _timestamp(blog.time_stamp), ranking.half_life)
+
+
+def on_blog_inserted(mapper, connection, blog):
+    _pending(blog, blog.id, blog.hot_score)
+
+
+def on_blog_delete(mapper, connection, blog):
+    _pending(blog, blog.id, None)
+
+
+def on_comment_insert(mapper, connection, comment):
+    if not comment.disable:
+        _bump(connection, comment, comment.blog_id,
+                ranking.weights['comment'], _timestamp(comment.time_stamp))
+
+
+def on_comment_delete(mapper, connection, comment):
+    if not comment.disable:
+        _bump(connection, comment, comment.blog_id,
+                -ranking.weights['comment'], _timestamp(comment.time_stamp))
+
+
+def on_comment_update(mapper, connection, comment):
+    '''评论被隐藏时减去它的贡献，恢复时加回'''
+    history = db.inspect(comment).attrs.disable.history
+    if not history.has_changes():
+        return
+    was_visible = not (history.deleted and history.deleted[0])
+    if was_visible != (not comment.disable):
+        weight = ranking.weights['comment']
+        _bump(connection, comment, comment.blog_id,
+                -weight if was_visible else weight,
+                _timestamp(comment.time_stamp))
+
+
+def on_follow(mapper, connection, follow):
+    '''关注作者时，作者最新的一篇博客得分增加'''
+    blog_id = connection.execute(db.select([blogs.c.id]).where(
+            blogs.c.author_id == follow.followed_id).order_by(
+            blogs.c.time_stamp.desc(), blogs.c.id.desc()).limit(1)).scalar()
+    if blog_id is not None:
+        _bump(connection, follow, blog_id, ranking.weights['follow'],
+                time.time())
+
+
+def apply_pending(session):
+    pending = session.info.pop('hot_pending', None)
+    if pending:
+        for blog_id, score in pending.items():
+            ranking.update(blog_id, score)
+
+
+def discard_pending(session, *args):
+    session.info.pop('hot_pending', None)
+
+
+db.event.listen(Blog, 'before_insert', on_blog_insert)
+db.event.listen(Blog, 'after_insert', on_blog_inserted)
+db.event.listen(Blog, 'after_delete', on_blog_delete)
+db.event.listen(Comment, 'after_insert', on_comment_insert)
+db.event.listen(Comment, 'after_delete', on_comment_delete)
+db.event.listen(Comment, 'after_update', on_comment_update)
+db.event.listen(Follow, 'after_insert', on_follow)
+db.event.listen(db.session, 'after_commit', apply_pending)
+db.event.listen(db.session, 'after_rollback', discard_pending)
+
+
+def rebuild(batch_size=500):
+    '''
+    根据博客的发布时间、作者现在的粉丝数和可见评论重新计算全部得分，返回博客数；
+    关注带来的得分无法还原，重建后不再包含
+    '''
+    half_life = ranking.half_life
+    comments = Comment.__table__
+    rows = db.session.query(Blog.id, Blog.time_stamp,
+            User.follower_count).outerjoin(User,
+            User.id == Blog.author_id).all()
+    scores = {blog_id: combine(None, post_weight(followers or 0),
+              _timestamp(time_stamp), half_life)
+              for blog_id, time_stamp, followers in rows}
+    weight = ranking.weights['comment']
+    visible = db.or_(comments.c.disable == False, comments.c.disable == None)
+    for blog_id, time_stamp in db.session.query(comments.c.blog_id,
+            comments.c.time_stamp).filter(visible).yield_per(batch_size):
+        if blog_id in scores:
+            scores[blog_id] = combine(scores[blog_id], weight,
+                    _timestamp(time_stamp), half_life)
+    items = list(scores.items())
+    stmt = blogs.update().where(blogs.c.id == db.bindparam('blog_id')).values(
+            hot_score=db.bindparam('score'), updated_at=blogs.c.updated_at)
+    for start in range(0, len(items), batch_size):
+        db.session.execute(stmt, [{'blog_id': blog_id, 'score': score}
+                for blog_id, score in items[start:start + batch_size]])
+    db.session.commit()
+    ranking.clear()
+    return len(items)
@@ -0,0 +1,132 @@
+'''
+登录用户的缓存
+
+flask-login 在同一个请求中只调用一次 user_loader ，结果保存在请求上下文中。
+这里再加一层进程内的缓存，保存用户数据和角色（权限位），有效期为
+IDENTITY_CACHE_TTL 秒，有效期内的请求不需要查询数据库。
+用户信息、密码或角色被修改并提交之后清除对应的缓存；
+其他进程中的缓存最多在有效期之后失效。
+'''
+
+import threading
+import time
+
+from .models import db, User, Role
+
+
+class IdentityCache:
+    '''保存脱离数据库会话的 User 实例，键为用户 ID'''
+
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._data.get(user_id)
+            if entry is None:
+                return None
+            expires, user = entry
+            if expires < time.monotonic():
+                del self._data[user_id]
+                return None
+            return user
+
+    def set(self, user_id, user):
+        with self._lock:
+            self._data[user_id] = (time.monotonic() + self.ttl, user)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._data.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+cache = IdentityCache()
+
+
+def init_app(app):
+    cache.ttl = app.config['IDENTITY_CACHE_TTL']
+
+
+def _load_detached(user_id):
+    '''
+    使用一个临时会话查询用户，关闭会话后得到的实例不属于任何会话，
+    不会因为请求中的事务提交而过期，也不会和请求中已经查询过的同一用户冲突
+    '''
+    session = db.create_session({})()
+    try:
+        # 角色通过联结查询一并加载，判断权限时不需要再查询
+        return session.query(User).options(db.joinedload(User.role)
+                ).filter_by(id=user_id).first()
+    finally:
+        session.close()
+
+
+def load_user(user_id):
+    '''flask-login 的 user_loader ，参数 user_id 是字符串'''
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    cached = cache.get(user_id)
+    if cached is None:
+        cached = _load_detached(user_id)
+        if cached is None:
+            return None
+        cache.set(user_id, cached)
+    # load=False 表示直接把缓存的数据放入当前会话，不查询数据库
+    return db.session.merge(cached, load=False)
+
+
+def invalidate_later(target, *user_ids):
+    '''
+    事务提交之后再清除这些用户的缓存，user_ids 为空时清空全部；
+    提交前就清除的话，其他请求可能在提交前重新读到旧的数据并放回缓存
+    '''
+    session = db.object_session(target)
+    if session is None:
+        if user_ids:
+            for user_id in user_ids:
+                cache.invalidate(user_id)
+        else:
+            cache.clear()
+        return
+    pending = session.info.setdefault('identity_pending', set())
+    pending.update(user_ids or (None,))
+
+
+def invalidate_user(mapper, connection, target):
+    invalidate_later(target, target.id)
+
+
+def invalidate_all(mapper, connection, target):
+    '''角色的权限变化会影响该角色的所有用户，直接清空缓存'''
+    invalidate_later(target)
+
+
+def apply_pending(session):
+    pending = session.info.pop('identity_pending', None)
+    if not pending:
+        return
+    if None in pending:
+        cache.clear()
+    else:
+        for user_id in pending:
+            cache.invalidate(user_id)
+
+
+def discard_pending(session, *args):
+    session.info.pop('identity_pending', None)
+
+
+db.event.listen(User, 'after_update', invalidate_user)
+db.event.listen(User, 'after_delete', invalidate_user)
+db.event.listen(Role, 'after_update', invalidate_all)
+db.event.listen(Role, 'after_delete', invalidate_all)
+db.event.listen(db.session, 'after_commit', apply_pending)
+db.event.listen(db.session, 'after_rollback', discard_pending)
@@ -0,0 +1,172 @@
+'''
+博客正文的 Markdown 渲染
+
+博客的 body 属性被赋值时，把 Markdown 转换为 HTML 并清洗后存入 body_html 。
+- Markdown 和 Bleach 的实例创建一次后重复使用，每个线程一份，它们都不是线程安全的；
+  这两个模块在第一次渲染时才导入，不渲染正文的进程启动时不必加载
+- 渲染结果按正文内容的哈希值缓存，内容相同的正文不会重复渲染
+- 超过 MARKDOWN_SYNC_LIMIT 个字符的正文在事务提交后交给后台线程渲染，
+  渲染完成之前页面显示原始正文
+'''
+
+import hashlib
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from flask import current_app
+from sqlalchemy import and_
+
+from .models import db, Blog, User
+from .cache import LRUCache, page_cache, blog_scopes
+
+ALLOWED_TAGS = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code',
+                'em', 'i', 'li', 'ol', 'pre', 'strong', 'ul', 'h1',
+                'h2', 'h3', 'h4', 'p']
+
+_local = threading.local()
+
+
+def _renderers():
+    '''返回当前线程的 Markdown 和 Cleaner 实例，首次调用时创建'''
+    if not hasattr(_local, 'markdown'):
+        # Markdown 和 Bleach 导入较慢，第一次渲染时才导入
+        from bleach.linkifier import LinkifyFilter, DEFAULT_CALLBACKS
+        from bleach.sanitizer import Cleaner
+        from markdown import Markdown
+        _local.markdown = Markdown(output_format='html')
+        # 清洗和添加链接在一次遍历中完成
+        _local.cleaner = Cleaner(tags=ALLOWED_TAGS, strip=True,
+                filters=[partial(LinkifyFilter, callbacks=DEFAULT_CALLBACKS)])
+    return _local.markdown, _local.cleaner
+
+
+cache = LRUCache()
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def content_key(body):
+    '''缓存的键为正文的哈希值，缓存中不必保存整篇正文'''
+    return hashlib.sha1(body.encode('utf-8')).hexdigest()
+
+
+def render(body):
+    '''把 Markdown 正文渲染为清洗过的 HTML ，结果会被缓存'''
+    key = content_key(body)
+    html = cache.get(key)
+    if html is None:
+        md, cleaner = _renderers()
+        html = cleaner.clean(md.reset().convert(body))
+        cache.set(key, html)
+    return html
+
+
+def init_app(app):
+    cache.maxsize = app.config['MARKDOWN_CACHE_SIZE']
+
+
+def _get_executor(app):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                    max_workers=app.config['MARKDOWN_RENDER_WORKERS'],
+                    thread_name_prefix='markdown')
+    return _executor
+
+
+def _render_and_store(app, blog_id, body):
+    '''在后台线程中渲染正文，正文在此期间被再次修改时放弃写入'''
+    html = render(body)
+    with app.app_context():
+        try:
+            result = db.session.execute(Blog.__table__.update().where(and_(
+                Blog.id == blog_id, Blog.body == body)).values(
+                body_html=html, updated_at=datetime.now()))
+            db.session.commit()
+            # 渲染结果直接写入数据库，不会触发模型事件，需要手动让页面缓存失效
+            if result.rowcount:
+                author = db.session.query(User.name).join(Blog,
+                        Blog.author_id == User.id).filter(
+                        Blog.id == blog_id).scalar()
+                page_cache.invalidate(*blog_scopes(blog_id, author))
+        except Exception:
+            db.session.rollback()
+            app.logger.exception('博客 %s 的正文渲染失败', blog_id)
+        finally:
+            db.session.remove()
+
+
+def on_change_body(target, value, old_value, initiator):
+    '''Blog.body 被赋值时调用'''
+    if value is None:
+        target.body_html = None
+        return
+    html = cache.get(content_key(value))
+    if html is None and len(value) <= \
+            current_app.config['MARKDOWN_SYNC_LIMIT']:
+        html = render(value)
+    target.body_html = html
+    # 长正文先标记，提交后再交给后台线程渲染
+    target._render_pending = html is None
+
+
+def collect_pending(session, flush_context):
+    '''flush 之后博客已经有了 id ，记录需要后台渲染的博客'''
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Blog) and obj.__dict__.pop('_render_pending',
+                False):
+            session.info.setdefault('render_pending', []).append(
+                    (obj.id, obj.body))
+
+
+def submit_pending(session):
+    '''事务提交之后才提交渲染任务，保证后台线程能读到这篇博客'''
+    pending = session.info.pop('render_pending', None)
+    if not pending:
+        return
+    app = current_app._get_current_object()
+    executor = _get_executor(app)
+    for blog_id, body in pending:
+        executor.submit(_render_and_store, app, blog_id, body)
+
+
+def discard_pending(session, *args):
+    session.info.pop('render_pending', None)
+
+
+db.event.listen(Blog.body, 'set', on_change_body)
+db.event.listen(db.session, 'after_flush', collect_pending)
+db.event.listen(db.session, 'after_commit', submit_pending)
+db.event.listen(db.session, 'after_rollback', discard_pending)
+
+
+def render_all(rerender=False, batch_size=500):
+    '''
+    批量渲染数据库中已有的博客，默认只处理 body_html 为空的博客
+    rerender 为 True 时全部重新渲染，例如修改了允许的标签之后
+    按 id 分批读取，每批渲染完成后提交一次
+    '''
+
+    # 和 _render_and_store 一样更新 updated_at ，换掉按更新时间缓存的 HTML 片段
+    stmt = Blog.__table__.update().where(
+            Blog.id == db.bindparam('blog_id')).values(
+            body_html=db.bindparam('html'), updated_at=datetime.now())
+    last_id, total = 0, 0
+    while True:
+        query = db.session.query(Blog.id, Blog.body).filter(
+                Blog.id > last_id, Blog.body != None)
+        if not rerender:
+            query = query.filter(Blog.body_html == None)
+        rows = query.order_by(Blog.id).limit(batch_size).all()
+        if not rows:
+            return total
+        db.session.execute(stmt, [{'blog_id': blog_id, 'html': render(body)}
+                for blog_id, body in rows])
+        db.session.commit()
+        # 直接写入数据库，不会触发模型事件，缓存的页面中还是旧的正文
+        page_cache.invalidate()
+        last_id = rows[-1][0]
+        total += len(rows)
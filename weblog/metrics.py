@@ -0,0 +1,206 @@
+'''
+每个视图的查询次数和耗时统计
+
+- 通过 SQLAlchemy 的 before_cursor_execute/after_cursor_execute 事件统计 SQL 的次数和耗时
+- 通过 Flask 的信号统计模板渲染耗时和整个请求的耗时
+- 统计结果按视图（endpoint）记录在进程内的直方图中，/metrics 以 Prometheus 文本格式输出，
+  只允许 METRICS_ALLOWED_ADDRS 中的地址访问
+- 其他模块用 register 登记统计函数，例如邮件队列的长度（gauge）和发送总数（counter）
+- 同一个请求中同一条 SQL 执行超过 METRICS_N_PLUS_ONE_THRESHOLD 次时记录警告，
+  这通常是模板中逐条访问关联对象导致的 N+1 查询
+'''
+
+import threading
+import time
+from collections import Counter
+
+from flask import g, request, has_request_context
+from flask import request_started, request_finished
+from flask import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# 直方图的分桶上限
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+            '\n', '\\n')
+
+
+class Histogram:
+    '''按 endpoint 分组的直方图'''
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._data = {}     # {endpoint: [每个桶的计数..., 总和, 次数]}
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, value):
+        with self._lock:
+            data = self._data.setdefault(endpoint,
+                    [0] * len(self.buckets) + [0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def totals(self):
+        '''返回 {endpoint: (总和, 次数)}'''
+        with self._lock:
+            return {k: (v[-2], v[-1]) for k, v in self._data.items()}
+
+    def expose(self):
+        '''输出 Prometheus 文本格式，桶的计数是累积的'''
+        lines = ['# HELP {} {}'.format(self.name, self.help),
+                 '# TYPE {} histogram'.format(self.name)]
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._data.items())
+        for endpoint, data in items:
+            label = 'endpoint="{}"'.format(_escape(endpoint))
+            for bound, count in zip(self.buckets, data):
+                lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                        self.name, label, bound, count))
+            lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(
+                    self.name, label, data[-1]))
+            lines.append('{}_sum{{{}}} {}'.format(self.name, label, data[-2]))
+            lines.append('{}_count{{{}}} {}'.format(self.name, label,
+                    data[-1]))
+        return lines
+
+
+class Metrics:
+    '''收集并输出统计数据'''
+
+    def __init__(self):
+        self.app = None
+        self.latency = Histogram('weblog_request_duration_seconds',
+                '请求的总耗时', TIME_BUCKETS)
+        self.sql_count = Histogram('weblog_request_sql_queries',
+                '每个请求执行的 SQL 次数', COUNT_BUCKETS)
+        self.sql_time = Histogram('weblog_request_sql_seconds',
+                '每个请求执行 SQL 的总耗时', TIME_BUCKETS)
+        self.render_time = Histogram('weblog_request_render_seconds',
+                '每个请求渲染模板的总耗时', TIME_BUCKETS)
+        self.histograms = [self.latency, self.sql_count, self.sql_time,
+                self.render_time]
+        # 其他模块登记的统计函数 {指标名前缀: (函数, counter 类型的名称)}
+        self.collectors = {}
+
+    def init_app(self, app):
+        self.app = app
+        if not app.config['METRICS_ENABLED']:
+            return
+        # 监听所有 Engine ，读写分离时的其他数据库连接也能统计到
+        if not event.contains(Engine, 'before_cursor_execute',
+                _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute',
+                    _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute',
+                    _after_cursor_execute)
+        request_started.connect(self._request_started, app)
+        request_finished.connect(self._request_finished, app)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+
+    def register(self, prefix, func, counters=()):
+        '''
+        登记统计函数，func 返回 {名称: 数值} ，输出为 prefix_名称 ；
+        counters 中的名称是只增不减的累计值，按 counter 类型输出并加上 _total 后缀，
+        其余按 gauge 输出。同一个前缀只保留最后登记的函数，多次 create_app 不会重复输出
+        '''
+        self.collectors[prefix] = (func, frozenset(counters))
+
+    def _request_started(self, sender, **extra):
+        g._metrics = {
+            'start': time.perf_counter(),
+            'sql_count': 0,
+            'sql_time': 0.0,
+            'render_time': 0.0,
+            'render_start': [],
+            'statements': Counter(),
+        }
+
+    def _before_render(self, sender, template, context, **extra):
+        stats = g.get('_metrics')
+        if stats is not None:
+            stats['render_start'].append(time.perf_counter())
+
+    def _after_render(self, sender, template, context, **extra):
+        stats = g.get('_metrics')
+        if stats is not None and stats['render_start']:
+            stats['render_time'] += time.perf_counter() - \
+                    stats['render_start'].pop()
+
+    def _request_finished(self, sender, response, **extra):
+        stats = g.get('_metrics')
+        # 流式响应在响应体发送完之后由 defer 返回的函数记录
+        if stats is None or stats.get('deferred'):
+            return
+        self._record(request.endpoint or 'unknown', stats)
+
+    def defer(self):
+        '''
+        流式响应返回时模板还没有渲染，其中的 SQL 也还没有执行，
+        返回一个函数，在响应体发送完（关闭）时调用，由它记录这个请求的统计数据
+        '''
+        stats = g.get('_metrics') if has_request_context() else None
+        if stats is None:
+            return lambda: None
+        stats['deferred'] = True
+        endpoint = request.endpoint or 'unknown'
+        return lambda: self._record(endpoint, stats)
+
+    def _record(self, endpoint, stats):
+        self.latency.observe(endpoint, time.perf_counter() - stats['start'])
+        self.sql_count.observe(endpoint, stats['sql_count'])
+        self.sql_time.observe(endpoint, stats['sql_time'])
+        self.render_time.observe(endpoint, stats['render_time'])
+        threshold = self.app.config['METRICS_N_PLUS_ONE_THRESHOLD']
+        for statement, count in stats['statements'].items():
+            if count > threshold:
+                self.app.logger.warning(
+                        '可能存在 N+1 查询：%s 中下面的 SQL 执行了 %d 次\n%s',
+                        endpoint, count, statement)
+
+    def expose(self):
+        '''所有统计数据的 Prometheus 文本格式'''
+        lines = []
+        for histogram in self.histograms:
+            lines.extend(histogram.expose())
+        for prefix, (func, counters) in sorted(self.collectors.items()):
+            for key, value in sorted(func().items()):
+                if key in counters:
+                    name, kind = '{}_{}_total'.format(prefix, key), 'counter'
+                else:
+                    name, kind = '{}_{}'.format(prefix, key), 'gauge'
+                lines.append('# TYPE {} {}'.format(name, kind))
+                lines.append('{} {}'.format(name, value))
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+        executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+        executemany):
+    start = conn.info['query_start'].pop()
+    if not has_request_context():
+        return
+    stats = g.get('_metrics')
+    if stats is None:
+        return
+    stats['sql_count'] += 1
+    stats['sql_time'] += time.perf_counter() - start
+    # SQL 中的参数都是占位符，同一个位置执行的查询文本相同
+    stats['statements'][statement] += 1
@@ -1,16 +1,14 @@
-from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
 from flask import current_app
 from datetime import datetime
 import enum
-import bleach
-from markdown import markdown
+from sqlalchemy.exc import IntegrityError
 
-import pymysql
-pymysql.install_as_MySQLdb()
+from .routing import RoutingSQLAlchemy
+from .passwords import hasher
 
-db = SQLAlchemy()
+# 配置了只读副本时，查询按请求类型发往主库或副本
+db = RoutingSQLAlchemy()
 
 class Gender(enum.Enum):
     """性别类，roel类中的gender属性要用到此类"""
@@ -21,6 +19,14 @@ class Follow(db.Model):
     '''存储用户关注信息的双主键映射类'''
 
     __tablename__ = 'follows'
+    # 主键的第一列是 follower_id ，按被关注者查询粉丝列表需要单独的索引；
+    # 两个列表都按关注时间倒序游标分页，索引中包含时间列和另一个 ID
+    __table_args__ = (
+        db.Index('ix_follows_followed_id_time_stamp', 'followed_id',
+                'time_stamp', 'follower_id'),
+        db.Index('ix_follows_follower_id_time_stamp', 'follower_id',
+                'time_stamp', 'followed_id'),
+    )
 
     follower_id = db.Column(db.Integer, db.ForeignKey('user.id'),
             primary_key=True)   # 关注者 ID
@@ -28,6 +34,63 @@ class Follow(db.Model):
             primary_key=True)   # 被关注者 ID
     time_stamp = db.Column(db.DateTime, default=datetime.now)
 
+class FeedItem(db.Model):
+    '''
+    预先推送的动态表，用户发布博客时为每个粉丝写入一行
+    读取「我关注的人的博客」时只需按 user_id 查这张表，不需要联结 follows
+    '''
+
+    __tablename__ = 'feed_items'
+    __table_args__ = (
+        db.Index('ix_feed_items_user_id_time_stamp', 'user_id', 'time_stamp',
+                'blog_id'),
+    )
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id',
+            ondelete='CASCADE'), primary_key=True)    # 动态的接收者 ID
+    blog_id = db.Column(db.Integer, db.ForeignKey('blog.id',
+            ondelete='CASCADE'), primary_key=True)
+    # 冗余存储博客作者和发布时间，取关时按作者删除，分页时按时间排序
+    author_id = db.Column(db.Integer, index=True)
+    time_stamp = db.Column(db.DateTime)
+
+class SearchDoc(db.Model):
+    '''全文索引中的文档，记录每篇文档的词数，用于计算 BM25 得分'''
+
+    __tablename__ = 'search_docs'
+
+    doc_type = db.Column(db.String(16), primary_key=True)   # blog 或 user
+    doc_id = db.Column(db.Integer, primary_key=True)
+    length = db.Column(db.Integer, default=0)
+
+class SearchPosting(db.Model):
+    '''全文索引的倒排表，每一行表示某个词在某篇文档中出现的次数'''
+
+    __tablename__ = 'search_postings'
+    __table_args__ = (
+        db.Index('ix_search_postings_doc', 'doc_type', 'doc_id'),
+    )
+
+    term = db.Column(db.String(64), primary_key=True)
+    doc_type = db.Column(db.String(16), primary_key=True)
+    doc_id = db.Column(db.Integer, primary_key=True)
+    tf = db.Column(db.Integer, default=1)     # 词频
+
+class UserStats(db.Model):
+    '''
+    用户的统计数据，冗余存储以免每次显示都执行 COUNT 查询
+    博客和评论增删时在同一个事务中更新，数据不一致时用 flask stats reconcile 重建；
+    关注数和粉丝数仍然保存在 User 中
+    '''
+
+    __tablename__ = 'user_stats'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id',
+            ondelete='CASCADE'), primary_key=True)
+    blog_count = db.Column(db.Integer, default=0, nullable=False)
+    # 可见评论的数量，不含被隐藏的评论
+    comment_count = db.Column(db.Integer, default=0, nullable=False)
+
 class Role(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), unique=True, index=True)
@@ -66,9 +129,17 @@ class User(db.Model, UserMixin):
     phone_number = db.Column(db.String(32), unique=True)
     location = db.Column(db.String(64))
     about_me = db.Column(db.Text())
-    avatar_hash = db.Column(db.String(128))
+    # 头像文件的哈希，头像地址中只有它，按它查询用户
+    avatar_hash = db.Column(db.String(128), index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow())
     last_seen = db.Column(db.DateTime, default=datetime.utcnow)
+    # 粉丝过多的作者发布博客时不再推送给每个粉丝，粉丝读取动态时直接查询
+    feed_pull = db.Column(db.Boolean, default=False)
+    # 冗余存储的关注数和粉丝数，随关注和取关通过 stats.change() 更新
+    followed_count = db.Column(db.Integer, default=0, nullable=False)
+    follower_count = db.Column(db.Integer, default=0, nullable=False)
+    # 博客数和评论数，由 stats.py 维护，只读
+    stats = db.relationship('UserStats', uselist=False, viewonly=True)
     # 此属性为「我关注了谁」，属性值为查询对象，里面是 Follow 类的实例
     # 参数 foreign_keys 意为查询 User.id 值等于 Follow.follower_id 的数据
     followed = db.relationship('Follow', foreign_keys=[Follow.follower_id],
@@ -102,9 +173,14 @@ class User(db.Model, UserMixin):
         return self._password
     @password.setter
     def password(self, pwd):
-        self._password = generate_password_hash(pwd)
+        self._password = hasher.hash(pwd)
     def verify_password(self, pwd):
-        return check_password_hash(self._password, pwd)
+        '''验证密码，哈希的参数已经过时的话顺便重新计算，由调用者提交'''
+        if not hasher.verify(self._password, pwd):
+            return False
+        if hasher.needs_rehash(self._password):
+            self.password = pwd
+        return True
     def __init__(self, **kw):
         """初始化实例， 给用户增加默认的角色"""
         super().__init__(**kw)
@@ -124,40 +200,63 @@ class User(db.Model, UserMixin):
     def has_permission(self, permission):
         '''判断用户是否有某种权限'''
         return self.role.permissions & Permission
+    def _stat(name):
+        return property(lambda self: getattr(self.stats, name)
+                if self.stats is not None else 0)
+    blog_count = _stat('blog_count')
+    comment_count = _stat('comment_count')
+    del _stat
+
     def __repr__(self):
         return '<User:{}>'.format(self.name)
     def pring(self):
-        self.last_seen = datetime.utcnow()
-        db.session.add(self)
-        db.session.commit()
+        '''记录用户的活跃时间，先缓存在内存中，定期批量写入数据库'''
+        from .presence import tracker
+        tracker.touch(self.id)
     def is_following(self, user):
         '''判断 self 用户是否关注了 user 用户'''
-        return self.followed.filter_by(followed_id=user.id).first() is not None
+        from .graph import graph
+        return graph.is_following(self.id, user.id)
 
     def is_followed_by(self, user):
-        '''判断 self 用户是否被 user 用户关注'''
-        return self.followers.filter_by(follower_id=user.id).first() is not None
+        '''判断 self 用户是否被 user 用户关注，只按主键查询一行'''
+        return Follow.query.get((user.id, self.id)) is not None
     def follow(self, user):
-        '''关注 user 用户，即向 follows 数据表中添加一条数据'''
-        if not self.is_following(user):
-            f = Follow(follower_id=self.id, followed_id=user.id)
-            db.session.add(f)
+        '''
+        关注 user 用户，即向 follows 数据表中添加一条数据，返回是否新增了关注；
+        进程内的关注关系缓存可能落后于其他进程的写入，这里直接查询数据库
+        '''
+        if Follow.query.get((self.id, user.id)) is not None:
+            return False
+        db.session.add(Follow(follower_id=self.id, followed_id=user.id))
+        try:
             db.session.commit()
+        except IntegrityError:
+            # 并发的请求在查询之后抢先添加了同一条关注
+            db.session.rollback()
+            return False
+        return True
 
     def unfollow(self, user):
-        '''取关 user 用户，即移除 follows 数据表中的一条数据'''
-        f = self.followed.filter_by(followed_id=user.id).first()
-        if f:
-            db.session.delete(f)
-            db.session.commit()
+        '''取关 user 用户，即移除 follows 数据表中的一条数据，返回是否取关了'''
+        f = Follow.query.get((self.id, user.id))
+        if f is None:
+            return False
+        db.session.delete(f)
+        db.session.commit()
+        return True
     @property
     def followed_posts(self):
         '''我关注的所有用户的全部博客'''
-        # query.join 为联表查询或者联结查询
-        # 查询 Follow 实例中被关注者 ID 等于 Post.author_id 的 Post 实例
-        # Follow 实例指的是哪些呢？关注者 ID 等于 self.id 的
-        return Blog.query.join(Follow, Follow.followed_id==Blog.author_id
-                ).filter(Follow.follower_id==self.id)
+        # 普通作者的博客在发布时已经推送到 feed_items 表
+        pushed = Blog.query.join(FeedItem, FeedItem.blog_id==Blog.id
+                ).filter(FeedItem.user_id==self.id)
+        # 粉丝过多的作者不推送，仍然通过联结 follows 表查询
+        # 查询 Follow 实例中被关注者 ID 等于 Blog.author_id 的 Blog 实例
+        pulled = Blog.query.join(Follow, Follow.followed_id==Blog.author_id
+                ).join(User, User.id==Follow.followed_id
+                ).filter(Follow.follower_id==self.id, User.feed_pull==True)
+        return pushed.union(pulled)
 
 
 
@@ -171,30 +270,50 @@ class Permission:
 
 class Blog(db.Model):
     '''博客'''
+    # 首页时间线和用户主页都按 (时间, ID) 倒序游标分页
+    __table_args__ = (
+        db.Index('ix_blog_time_stamp_id', 'time_stamp', 'id'),
+        db.Index('ix_blog_author_id_time_stamp_id', 'author_id',
+                'time_stamp', 'id'),
+        # 热门排行按得分从高到低读取前若干篇
+        db.Index('ix_blog_hot_score_id', 'hot_score', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text)
     body_html = db.Column(db.Text)
     time_stamp = db.Column(db.DateTime, default=datetime.now)
+    # 最后修改时间，用作博客 HTML 片段缓存的键
+    updated_at = db.Column(db.DateTime, default=datetime.now,
+            onupdate=datetime.now)
+    # 冗余存储的评论数（不含被隐藏的评论），在 comments.py 中随评论变化更新
+    comment_count = db.Column(db.Integer, default=0, nullable=False)
+    # 对数化的热度得分，由 hot.py 随评论和关注更新，为空表示没有热度
+    hot_score = db.Column(db.Float)
     author_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'))
     author = db.relationship('User', backref=db.backref('blogs', lazy='dynamic', cascade='all, delete-orphan'))
+
     @staticmethod
-    def on_change_body(target, value, old_value, initiator):
-        allowed_tags = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code',
-                        'em', 'i', 'li', 'ol', 'pre', 'strong', 'ul', 'h1',
-                        'h2', 'h3', 'h4', 'p']
-        target.body_html = bleach.linkify(bleach.clean(
-            markdown(value, output_format='html'), tags = allowed_tags,
-            strip = True
-        ))
-        db.event.listen(Blog.body, 'set', Blog.on_change_body)
+    def timeline():
+        '''首页时间线查询，作者信息通过联结查询一并加载，避免模板中逐条查询作者'''
+        return Blog.query.options(db.joinedload(Blog.author))
 
 class Comment(db.Model):
     '''评论映射类'''
 
+    __table_args__ = (
+        # 博客页面按时间倒序分页读取评论
+        db.Index('ix_comment_blog_id_time_stamp_id', 'blog_id', 'time_stamp',
+                'id'),
+        # 导出数据时按 id 顺序读取用户的全部评论
+        db.Index('ix_comment_author_id_id', 'author_id', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text)
     time_stamp = db.Column(db.DateTime, index=True, default=datetime.now)
-    disable = db.Column(db.Boolean)
+    # active_history 让修改时总能拿到旧值，comments.py 据此更新可见评论数
+    disable = db.column_property(db.Column(db.Boolean), active_history=True)
     author_id = db.Column(db.Integer,
             db.ForeignKey('user.id', ondelete='CASCADE'))
     author = db.relationship('User', backref=db.backref('comments',
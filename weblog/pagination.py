@@ -0,0 +1,83 @@
+'''
+游标（keyset）分页
+
+OFFSET 分页翻到越后面越慢，数据库要先数出前面所有的行再丢掉；
+paginate() 还要额外执行一次 COUNT(*)。
+这里改为记住上一页最后一行的 (时间, 主键)，下一页直接从这个位置往后取，
+配合索引只扫描需要的行，也不需要统计总数。
+'''
+
+import base64
+import binascii
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+
+def encode_cursor(time_stamp, key):
+    '''把 (时间, 主键) 编码成 URL 安全的游标字符串'''
+    raw = '{}|{}'.format(time_stamp.isoformat(), key)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    '''解析游标字符串，格式不正确时返回 None ，相当于从第一页开始'''
+    if not cursor:
+        return None
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(cursor + padding).decode()
+        time_stamp, key = raw.split('|')
+        return datetime.fromisoformat(time_stamp), int(key)
+    except (ValueError, TypeError, binascii.Error, UnicodeDecodeError):
+        return None
+
+
+class KeysetPagination:
+    '''游标分页的结果，模板中通过 next_cursor 生成「下一页」链接'''
+
+    def __init__(self, items, per_page, has_next, cursor=None,
+            key_func=None):
+        self.items = items
+        self.per_page = per_page
+        self.has_next = has_next
+        self.cursor = cursor
+        # key_func 从一行数据中取出 (时间, 主键)，默认取 time_stamp 和 id
+        self.key_func = key_func or (lambda item: (item.time_stamp, item.id))
+
+    @property
+    def has_prev(self):
+        '''带游标的请求都不是第一页，模板中据此显示「回到最新」'''
+        return self.cursor is not None
+
+    @property
+    def next_cursor(self):
+        if not self.has_next or not self.items:
+            return None
+        return encode_cursor(*self.key_func(self.items[-1]))
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+def keyset_paginate(query, time_column, key_column, cursor=None,
+        per_page=10, key_func=None):
+    '''
+    对查询对象做倒序的游标分页，参数分别是：
+    查询对象，时间列，用于打破时间相同情况的主键列，游标字符串，每页数量
+    每次多取一行，用来判断是否还有下一页
+    '''
+
+    position = decode_cursor(cursor)
+    if position is not None:
+        time_stamp, key = position
+        query = query.filter(or_(
+            time_column < time_stamp,
+            and_(time_column == time_stamp, key_column < key)
+        ))
+    rows = query.order_by(time_column.desc(), key_column.desc()
+            ).limit(per_page + 1).all()
+    return KeysetPagination(rows[:per_page], per_page,
+            has_next=len(rows) > per_page,
+            cursor=cursor if position is not None else None,
+            key_func=key_func)
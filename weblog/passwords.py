@@ -0,0 +1,114 @@
+'''
+密码哈希服务和登录尝试限制
+
+- 计算密码哈希是 CPU 密集的操作，在请求线程中执行会持有 GIL ，阻塞同一进程中的其他请求，
+  这里交给进程池执行，进程数量由 PASSWORD_HASH_WORKERS 限定，为 0 时在当前线程中执行
+- 哈希算法和迭代次数由 PASSWORD_HASH_METHOD 指定，用户登录成功时，
+  如果保存的哈希使用的是旧的参数，就用新的参数重新计算
+- 登录前按 IP 和邮箱分别统计最近一段时间内的失败次数，超过限制时不再验证密码，
+  暴力破解的请求不会消耗计算哈希的 CPU ；统计数据保存在进程内
+'''
+
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS
+
+
+def _normalize(method):
+    '''转换为哈希中保存的形式，pbkdf2 未指定迭代次数时 werkzeug 使用默认值'''
+    if method.startswith('pbkdf2:') and method.count(':') == 1:
+        return '{}:{}'.format(method, DEFAULT_PBKDF2_ITERATIONS)
+    return method
+
+
+class PasswordHasher:
+    '''在进程池中计算和验证密码哈希'''
+
+    def __init__(self):
+        self.method = _normalize('pbkdf2:sha256')
+        self.salt_length = 8
+        self.workers = 0
+        # gevent 模式下替换为在原生线程中执行的线程池，见 cooperative.py
+        self.executor_class = ProcessPoolExecutor
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.method = _normalize(app.config['PASSWORD_HASH_METHOD'])
+        self.salt_length = app.config['PASSWORD_SALT_LENGTH']
+        self.workers = app.config['PASSWORD_HASH_WORKERS']
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = self.executor_class(self.workers)
+            return self._executor
+
+    def _run(self, func, *args):
+        if not self.workers:
+            return func(*args)
+        return self._get_executor().submit(func, *args).result()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method,
+                self.salt_length)
+
+    def verify(self, pwhash, password):
+        if not pwhash:
+            return False
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        '''保存的哈希使用的算法或迭代次数与当前配置不同'''
+        return pwhash.split('$', 1)[0] != self.method
+
+
+hasher = PasswordHasher()
+
+
+class AttemptLimiter:
+    '''滑动窗口内的尝试次数限制，键可以是 IP 地址或邮箱'''
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _recent(self, key, window, now):
+        attempts = self._data.get(key)
+        if attempts is None:
+            return None
+        while attempts and attempts[0] <= now - window:
+            attempts.popleft()
+        return attempts
+
+    def blocked_for(self, key, limit, window):
+        '''返回还需要等待的秒数，没有超过限制时返回 0'''
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._recent(key, window, now)
+            if not attempts or len(attempts) < limit:
+                return 0
+            return int(attempts[-limit] + window - now) + 1
+
+    def hit(self, key, window):
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._recent(key, window, now)
+            if attempts is None:
+                attempts = self._data[key] = deque()
+            attempts.append(now)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def reset(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+login_limiter = AttemptLimiter()
@@ -0,0 +1,81 @@
+'''
+用户最近活跃时间的记录
+
+每个请求都更新 last_seen 并提交事务的代价太高，这里先把时间记录在内存中：
+- 同一个用户距离上次记录不足 PRESENCE_RECORD_INTERVAL 秒时不再记录
+- 缓冲区中的数据每隔 PRESENCE_FLUSH_INTERVAL 秒用一条批量 UPDATE 写入数据库
+- 进程退出时把剩余的数据写入数据库
+'''
+
+import atexit
+import threading
+import time
+from datetime import datetime
+
+from .models import db, User
+
+
+class PresenceTracker:
+    '''缓冲用户 ID 到活跃时间的映射，定期批量写入数据库'''
+
+    def __init__(self, record_interval=60, flush_interval=30):
+        self.record_interval = record_interval
+        self.flush_interval = flush_interval
+        self.app = None
+        self._buffer = {}       # 等待写入的 {用户 ID: 活跃时间}
+        self._recorded = {}     # 每个用户上次被记录的时间
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.record_interval = app.config['PRESENCE_RECORD_INTERVAL']
+        self.flush_interval = app.config['PRESENCE_FLUSH_INTERVAL']
+        atexit.register(self.flush)
+
+    def touch(self, user_id):
+        '''记录用户的一次访问，到了写入时间时顺便写入数据库'''
+        now = time.monotonic()
+        with self._lock:
+            last = self._recorded.get(user_id)
+            if last is None or now - last >= self.record_interval:
+                self._recorded[user_id] = now
+                self._buffer[user_id] = datetime.utcnow()
+            due = now - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        '''把缓冲区中的数据用一条批量 UPDATE 写入数据库'''
+        now = time.monotonic()
+        with self._lock:
+            self._last_flush = now
+            buffer, self._buffer = self._buffer, {}
+            # 超过 record_interval 的记录不会再阻止下一次记录，删掉它们，
+            # 只保留最近活跃的用户，不随访问过的用户数无限增长
+            self._recorded = {uid: last for uid, last in
+                    self._recorded.items()
+                    if now - last < self.record_interval}
+        if not buffer or self.app is None:
+            return 0
+        stmt = User.__table__.update().where(
+                User.id == db.bindparam('user_id')).values(
+                last_seen=db.bindparam('last_seen'))
+        try:
+            # 使用单独的连接和事务，不影响当前请求中的数据库会话
+            with self.app.app_context():
+                with db.engine.begin() as connection:
+                    connection.execute(stmt, [
+                        {'user_id': uid, 'last_seen': ts}
+                        for uid, ts in buffer.items()])
+        except Exception:
+            self.app.logger.exception('写入用户活跃时间失败')
+            # 写入失败时放回缓冲区下次再试，期间又被记录的用户保留新的时间
+            with self._lock:
+                for uid, ts in buffer.items():
+                    self._buffer.setdefault(uid, ts)
+            return 0
+        return len(buffer)
+
+
+tracker = PresenceTracker()
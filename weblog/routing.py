@@ -0,0 +1,118 @@
+'''
+数据库的读写分离
+
+配置了只读副本（SQLALCHEMY_REPLICAS 中列出的 bind）时，GET 和 HEAD 请求中的查询发往副本，
+其他请求、写入数据的语句以及 flush 都发往主库。
+副本的数据有延迟，用户自己修改数据之后的 REPLICA_STICKY_SECONDS 秒内，
+这个用户的所有请求仍然读取主库，保证能看到自己刚刚写入的内容。
+一个会话写入过数据之后，其余的查询也都读取主库；
+会修改数据的 GET 视图用 primary_only 装饰，写入之前的查询也读取主库。
+'''
+
+import random
+import time
+from functools import wraps
+
+from flask import current_app, request, session, has_request_context, g
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+from sqlalchemy.sql.dml import UpdateBase
+
+# Flask 的 session 中记录「在这个时间之前读取主库」的键
+STICKY_KEY = '_primary_until'
+
+
+def _stick(app):
+    session[STICKY_KEY] = time.time() + app.config['REPLICA_STICKY_SECONDS']
+
+
+def _read_from_replica():
+    '''当前请求能否读取副本'''
+    if not has_request_context() or request.method not in ('GET', 'HEAD'):
+        return False
+    if g.get('_read_primary'):
+        return False
+    return session.get(STICKY_KEY, 0) <= time.time()
+
+
+def primary_only(f):
+    '''
+    视图函数的装饰器，请求中的所有查询都读取主库；
+    用于会修改数据的 GET 视图，写入之前的判断不能读到延迟的副本
+    '''
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        g._read_primary = True
+        return f(*args, **kwargs)
+    return wrapper
+
+
+class RoutingSession(SignallingSession):
+    '''按请求类型和语句类型选择主库或副本的会话'''
+
+    def __init__(self, db, **options):
+        self.db = db
+        # 每个会话固定使用一个副本，同一个请求中读到的数据是一致的
+        self._replica = None
+        # 写入过数据之后，这个会话的查询都读取主库，副本上还没有刚写入的数据
+        self._wrote = False
+        SignallingSession.__init__(self, db, **options)
+        event.listen(self, 'after_commit', self._stick_to_primary)
+        event.listen(self, 'after_rollback', self._forget_writes)
+
+    def get_bind(self, mapper=None, clause=None):
+        replicas = self.app.config['SQLALCHEMY_REPLICAS']
+        writing = self._flushing or isinstance(clause, UpdateBase)
+        if writing:
+            self._wrote = True
+            self.info['routing_wrote'] = True
+        elif replicas and not self._wrote and \
+                not self._has_bind_key(mapper) and _read_from_replica():
+            if self._replica is None:
+                self._replica = random.choice(replicas)
+            return self.db.get_engine(self.app, bind=self._replica)
+        return SignallingSession.get_bind(self, mapper, clause)
+
+    @staticmethod
+    def _has_bind_key(mapper):
+        '''指定了 __bind_key__ 的模型按原来的方式选择数据库'''
+        if mapper is None:
+            return False
+        info = getattr(mapper.persist_selectable, 'info', {})
+        return info.get('bind_key') is not None
+
+    def _stick_to_primary(self, session_):
+        if self.info.pop('routing_wrote', False) and has_request_context() \
+                and self.app.config['SQLALCHEMY_REPLICAS']:
+            _stick(self.app)
+
+    def _forget_writes(self, session_):
+        self.info.pop('routing_wrote', None)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    '''会话使用 RoutingSession 的 SQLAlchemy'''
+
+    def init_app(self, app):
+        SQLAlchemy.init_app(self, app)
+        app.after_request(_stick_after_post)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        # mysql:// 默认使用 MySQLdb 驱动，由 pymysql 代替。
+        # 创建引擎时才导入，不使用 MySQL 的进程不必加载它
+        if sa_url.drivername == 'mysql':
+            import pymysql
+            pymysql.install_as_MySQLdb()
+        return SQLAlchemy.apply_driver_hacks(self, app, sa_url, options)
+
+
+def _stick_after_post(response):
+    '''POST 等请求可能不经过会话直接写入数据库，之后同样读取主库'''
+    if request.method not in ('GET', 'HEAD', 'OPTIONS') and \
+            response.status_code < 400 and \
+            current_app.config['SQLALCHEMY_REPLICAS']:
+        _stick(current_app)
+    return response
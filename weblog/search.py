@@ -0,0 +1,239 @@
+'''
+博客和用户的全文搜索
+
+索引保存在数据库的 search_docs 和 search_postings 两张表中，不依赖外部的搜索服务。
+- 分词：中日韩文字按相邻两个字切分（二元分词），索引时另外按单字切分，
+  只有一个字的搜索词也能匹配；其他文字按单词切分
+- 索引：Blog 和 User 写入数据库后，在同一个事务中更新它们的倒排表
+- 排序：按 BM25 算法计算每篇文档的得分，得分在数据库中汇总，只取出当前页的文档；
+  每个词最多读取最新的 SEARCH_MAX_CANDIDATES 篇文档的倒排记录
+'''
+
+import math
+import re
+import unicodedata
+from collections import Counter
+
+from flask import current_app
+
+from .models import db, Blog, User, SearchDoc, SearchPosting
+
+docs = SearchDoc.__table__
+postings = SearchPosting.__table__
+
+# 中日韩文字的范围：平假名、片假名、汉字、扩展 A 区、兼容汉字、韩文
+_CJK = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af'
+_TOKEN_RE = re.compile('([{0}]+)|([^\\W_{0}]+)'.format(_CJK))
+MAX_TERM_LENGTH = 64
+
+# BM25 的参数
+K1 = 1.2
+B = 0.75
+# 文档数量较少时不忽略常见词，否则小站点的搜索结果会缺少匹配
+MIN_DF_LIMIT = 1000
+
+
+def tokenize(text, unigrams=False):
+    '''
+    把文本切分为词，返回生成器
+    unigrams 为 True 时（建立索引）连续的中日韩文字除了二元分词还按单字切分
+    '''
+    if not text:
+        return
+    text = unicodedata.normalize('NFKC', text).lower()
+    for match in _TOKEN_RE.finditer(text):
+        cjk, word = match.groups()
+        if word:
+            yield word[:MAX_TERM_LENGTH]
+        elif len(cjk) == 1:
+            yield cjk
+        else:
+            for i in range(len(cjk) - 1):
+                yield cjk[i:i + 2]
+            if unigrams:
+                yield from cjk
+
+
+def _blog_text(blog):
+    return blog.body
+
+
+def _user_text(user):
+    return ' '.join(filter(None, [user.name, user.about_me]))
+
+
+# 每种文档的类型名、索引的文本和影响文本的属性
+DOC_TYPES = {
+    Blog: ('blog', _blog_text, ('body',)),
+    User: ('user', _user_text, ('name', 'about_me')),
+}
+
+
+def _write_doc(connection, doc_type, doc_id, text):
+    '''在给定的连接上重写一篇文档的索引'''
+    _delete_doc(connection, doc_type, doc_id)
+    terms = Counter(tokenize(text, unigrams=True))
+    connection.execute(docs.insert(), doc_type=doc_type, doc_id=doc_id,
+            length=sum(terms.values()))
+    if terms:
+        connection.execute(postings.insert(), [
+            {'term': term, 'doc_type': doc_type, 'doc_id': doc_id, 'tf': tf}
+            for term, tf in terms.items()])
+
+
+def _delete_doc(connection, doc_type, doc_id):
+    connection.execute(postings.delete().where(db.and_(
+        postings.c.doc_type == doc_type, postings.c.doc_id == doc_id)))
+    connection.execute(docs.delete().where(db.and_(
+        docs.c.doc_type == doc_type, docs.c.doc_id == doc_id)))
+
+
+def on_insert(mapper, connection, target):
+    doc_type, get_text, fields = DOC_TYPES[mapper.class_]
+    _write_doc(connection, doc_type, target.id, get_text(target))
+
+
+def on_update(mapper, connection, target):
+    doc_type, get_text, fields = DOC_TYPES[mapper.class_]
+    state = db.inspect(target)
+    # 只有被索引的属性发生变化时才重建索引，例如更新关注数时不需要
+    if any(state.attrs[field].history.has_changes() for field in fields):
+        _write_doc(connection, doc_type, target.id, get_text(target))
+
+
+def on_delete(mapper, connection, target):
+    doc_type = DOC_TYPES[mapper.class_][0]
+    _delete_doc(connection, doc_type, target.id)
+
+
+for model in DOC_TYPES:
+    db.event.listen(model, 'after_insert', on_insert)
+    db.event.listen(model, 'after_update', on_update)
+    db.event.listen(model, 'after_delete', on_delete)
+
+
+class SearchResult:
+    '''一页搜索结果，items 为按得分排序的 Blog 或 User 实例'''
+
+    def __init__(self, items, total, page, per_page):
+        self.items = items
+        self.total = total
+        self.page = page
+        self.per_page = per_page
+
+    @property
+    def pages(self):
+        return max(1, math.ceil(self.total / self.per_page))
+
+    @property
+    def has_prev(self):
+        return self.page > 1
+
+    @property
+    def has_next(self):
+        return self.page < self.pages
+
+
+def _cutoffs(doc_type, terms, limit):
+    '''
+    出现在超过 limit 篇文档中的词只读取最新的 limit 篇，
+    返回 {词: 最小的文档 ID} ，按主键 (term, doc_type, doc_id) 的顺序读取
+    '''
+    cutoffs = {}
+    for term in terms:
+        cutoffs[term] = db.session.query(SearchPosting.doc_id).filter(
+                SearchPosting.term == term,
+                SearchPosting.doc_type == doc_type).order_by(
+                SearchPosting.doc_id.desc()).offset(limit - 1).limit(
+                1).scalar()
+    return cutoffs
+
+
+def _rank(doc_type, terms, offset, limit):
+    '''返回 (匹配的文档数, [(得分, 文档 ID)]) ，只返回从 offset 开始的 limit 篇'''
+    total_docs, avg_length = db.session.query(
+            db.func.count(SearchDoc.doc_id), db.func.avg(SearchDoc.length)
+            ).filter(SearchDoc.doc_type == doc_type).one()
+    if not total_docs:
+        return 0, []
+    avg_length = float(avg_length) or 1.0
+    # 先统计每个词出现在多少篇文档中，过于常见的词区分度很低，不读取它的倒排表；
+    # 所有词都很常见时只使用其中最少见的一个
+    freq = dict(db.session.query(SearchPosting.term,
+            db.func.count(SearchPosting.doc_id)).filter(
+            SearchPosting.doc_type == doc_type,
+            SearchPosting.term.in_(terms)).group_by(SearchPosting.term))
+    if not freq:
+        return 0, []
+    max_df = max(current_app.config['SEARCH_MAX_DF_RATIO'] * total_docs,
+            MIN_DF_LIMIT)
+    useful = [t for t in freq if freq[t] <= max_df] or \
+            [min(freq, key=freq.get)]
+    max_candidates = current_app.config['SEARCH_MAX_CANDIDATES']
+    conditions = []
+    for term, cutoff in _cutoffs(doc_type, [t for t in useful
+            if freq[t] > max_candidates], max_candidates).items():
+        conditions.append(db.and_(SearchPosting.term == term,
+                SearchPosting.doc_id >= cutoff))
+    uncapped = [t for t in useful if freq[t] <= max_candidates]
+    if uncapped:
+        conditions.append(SearchPosting.term.in_(uncapped))
+    matches = db.and_(SearchPosting.doc_type == doc_type,
+            db.or_(*conditions))
+    total = db.session.query(db.func.count(db.distinct(
+            SearchPosting.doc_id))).filter(matches).scalar()
+    # 每个词的 idf 是常数，每条倒排记录的得分在数据库中计算并按文档求和
+    idf = {term: math.log(1 + (total_docs - freq[term] + 0.5) /
+            (freq[term] + 0.5)) for term in useful}
+    norm = K1 * (1 - B + B * db.func.coalesce(SearchDoc.length, 0) /
+            avg_length)
+    score = db.func.sum(db.case(idf, value=SearchPosting.term) *
+            SearchPosting.tf * (K1 + 1) / (SearchPosting.tf + norm)
+            ).label('score')
+    rows = db.session.query(score, SearchPosting.doc_id).join(SearchDoc,
+            db.and_(SearchDoc.doc_type == SearchPosting.doc_type,
+            SearchDoc.doc_id == SearchPosting.doc_id)).filter(
+            matches).group_by(SearchPosting.doc_id).order_by(
+            db.desc('score'), SearchPosting.doc_id.desc()).offset(
+            offset).limit(limit).all()
+    return total, rows
+
+
+def search(q, doc_type='blog', page=1, per_page=10):
+    '''搜索博客或用户，返回 SearchResult'''
+    terms = list(set(tokenize(q)))[:current_app.config['SEARCH_MAX_TERMS']]
+    page = max(page, 1)
+    total, ranked = _rank(doc_type, terms, (page - 1) * per_page,
+            per_page) if terms else (0, [])
+    ids = [doc_id for score, doc_id in ranked]
+    if not ids:
+        return SearchResult([], total, page, per_page)
+    if doc_type == 'blog':
+        query = Blog.timeline().filter(Blog.id.in_(ids))
+    else:
+        query = User.query.filter(User.id.in_(ids))
+    found = {obj.id: obj for obj in query}
+    items = [found[doc_id] for doc_id in ids if doc_id in found]
+    return SearchResult(items, total, page, per_page)
+
+
+def reindex(batch_size=500):
+    '''清空并重建全部索引，按 id 分批读取，每批提交一次'''
+    db.session.execute(postings.delete())
+    db.session.execute(docs.delete())
+    db.session.commit()
+    total = 0
+    for model, (doc_type, get_text, fields) in DOC_TYPES.items():
+        last_id = 0
+        while True:
+            rows = model.query.filter(model.id > last_id).order_by(
+                    model.id).limit(batch_size).all()
+            if not rows:
+                break
+            connection = db.session.connection()
+            for obj in rows:
+                _write_doc(connection, doc_type, obj.id, get_text(obj))
+            db.session.commit()
+            last_id = rows[-1].id
+            total += len(rows)
+    return total
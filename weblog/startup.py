@@ -0,0 +1,94 @@
+'''
+应用启动的耗时
+
+多进程部署时每个进程都要导入模块、初始化扩展、编译模板，频繁重启时这部分开销很明显：
+- create_app 中的每一步都记录耗时，第三方扩展在各自的步骤中导入，导入的时间也计入其中；
+  STARTUP_REPORT 打开时把结果写入日志，flask startup report 也会输出
+- 模板编译的结果保存在 JINJA_BYTECODE_CACHE_DIR 中，进程重启后直接加载，不再重新编译，
+  部署时可以先执行 flask startup compile 生成
+- TEMPLATE_WARMUP 打开时在 create_app 中加载全部模板，第一个请求不必等待模板编译
+'''
+
+import os
+import re
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from jinja2 import FileSystemBytecodeCache
+
+# python -X importtime 输出的一行：import time: 自身耗时 | 累计耗时 | 模块名
+_IMPORT_TIME = re.compile(r'^import time:\s+(\d+) \|\s+\d+ \|\s*(\S+)')
+
+
+class StartupTimer:
+    '''记录启动过程中每一步的耗时'''
+
+    def __init__(self):
+        self.steps = []
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def step(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps.append((name, time.perf_counter() - started))
+
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def report(self):
+        '''返回每一步的耗时说明，按耗时从长到短排列'''
+        lines = ['{:<28} {:>8.1f} ms'.format(name, seconds * 1000)
+                 for name, seconds in sorted(self.steps, key=lambda s: -s[1])]
+        lines.append('{:<28} {:>8.1f} ms'.format('合计', self.total() * 1000))
+        return lines
+
+
+def init_bytecode_cache(app):
+    '''模板编译的结果保存到文件系统，多个进程和重启之后都可以使用'''
+    if not app.config['JINJA_BYTECODE_CACHE']:
+        return
+    directory = app.config['JINJA_BYTECODE_CACHE_DIR'] or os.path.join(
+            app.instance_path, 'jinja')
+    os.makedirs(directory, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+
+def warm_up(app):
+    '''加载全部模板，返回加载的数量'''
+    names = app.jinja_env.list_templates(
+            filter_func=lambda name: name.endswith('.html'))
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+def import_times(module='weblog.app'):
+    '''
+    在新的进程中用 python -X importtime 导入 module ，
+    返回按顶层包汇总的导入耗时 [(包名, 秒)] ，按耗时从长到短排列
+    '''
+    # 新的进程使用与当前进程相同的模块搜索路径
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in sys.path if p))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+            'import ' + module], stderr=subprocess.PIPE,
+            universal_newlines=True, env=env)
+    if result.returncode != 0:
+        raise RuntimeError('导入 {} 失败：\n{}'.format(module,
+                result.stderr[-2000:]))
+    totals = defaultdict(int)
+    for line in result.stderr.splitlines():
+        match = _IMPORT_TIME.match(line)
+        if match is None:
+            continue
+        name = match.group(2)
+        # weblog 自己的模块分别统计，其他按顶层包统计
+        package = name if name.startswith('weblog') else name.split('.')[0]
+        totals[package] += int(match.group(1))
+    return sorted(((name, us / 1e6) for name, us in totals.items()),
+            key=lambda item: -item[1])
@@ -0,0 +1,72 @@
+'''
+用户统计数据 user_stats 的维护
+
+- 用户写入数据库时创建统计行，删除时一并删除
+- 博客增删时在这里更新作者的博客数；关注关系和评论的数量分别由 graph.py 和
+  comments.py 调用 change() 更新，它们都在触发变化的同一个事务中执行
+- 关注数和粉丝数保存在 user 表中，change() 把它们写到 user 表，其他计数写到 user_stats
+- 计数都用 UPDATE ... SET x = x + 1 的方式修改，并发修改时不会相互覆盖
+'''
+
+from .models import db, User, Blog, Comment, UserStats
+
+stats = UserStats.__table__
+users = User.__table__
+COUNTS = ('blog_count', 'comment_count')
+USER_COUNTS = ('follower_count', 'followed_count')
+
+
+def change(connection, user_id, **deltas):
+    '''在给定的连接上修改 user_id 的计数，例如 change(conn, 1, blog_count=1)'''
+    for table, key, names in ((stats, stats.c.user_id, COUNTS),
+            (users, users.c.id, USER_COUNTS)):
+        values = {name: table.c[name] + delta
+                  for name, delta in deltas.items() if name in names}
+        if values:
+            connection.execute(table.update().where(key == user_id)
+                    .values(values))
+
+
+def on_user_insert(mapper, connection, user):
+    connection.execute(stats.insert(), user_id=user.id)
+
+
+def on_user_delete(mapper, connection, user):
+    connection.execute(stats.delete().where(stats.c.user_id == user.id))
+
+
+def on_blog_insert(mapper, connection, blog):
+    change(connection, blog.author_id, blog_count=1)
+
+
+def on_blog_delete(mapper, connection, blog):
+    change(connection, blog.author_id, blog_count=-1)
+
+
+db.event.listen(User, 'after_insert', on_user_insert)
+db.event.listen(User, 'after_delete', on_user_delete)
+db.event.listen(Blog, 'after_insert', on_blog_insert)
+db.event.listen(Blog, 'after_delete', on_blog_delete)
+
+
+def reconcile():
+    '''根据博客和评论重建全部用户的统计数据，关注数由 graph.recount() 重新计算'''
+
+    def count(table, *conditions):
+        return db.select([db.func.count()]).select_from(table) \
+                .where(db.and_(*conditions)).as_scalar()
+
+    blogs = Blog.__table__
+    comments = Comment.__table__
+    db.session.execute(stats.delete())
+    db.session.execute(stats.insert().from_select(
+        ['user_id'] + list(COUNTS),
+        db.select([
+            users.c.id,
+            count(blogs, blogs.c.author_id == users.c.id),
+            count(comments, comments.c.author_id == users.c.id,
+                  db.or_(comments.c.disable == False,
+                         comments.c.disable == None)),
+        ])))
+    db.session.commit()
+    return db.session.query(db.func.count(UserStats.user_id)).scalar()
@@ -0,0 +1,77 @@
+'''
+流式渲染模板
+
+render_template 要把整个页面渲染成字符串后才开始发送，博客很多的页面首字节时间很长。
+stream_template 一边渲染一边发送：页面头部和导航栏先发出，
+列表部分每渲染出 STREAM_BUFFER_SIZE 段内容发送一次。
+列表的数据可以直接传入查询对象，流式渲染时按 STREAM_YIELD_PER 行分批读取（yield_per），
+边读取边渲染，内存占用不随行数增长。
+
+注意：
+- 响应头（包括 Cookie）在渲染开始前就已经发出，渲染过程中不能再修改会话，
+  所以在开始之前先取出 flash 消息、生成 CSRF 令牌
+- MySQL 使用服务器端游标读取 yield_per 的查询，读取完之前同一个连接不能执行其他查询，
+  模板中逐行访问的关联对象要预先加载
+- 流式的响应不能整页缓存，未登录用户的页面仍然整页渲染，交给页面缓存
+- 响应返回时模板还没有渲染，请求的耗时和 SQL 次数在响应体关闭时才记录，见 metrics.defer
+'''
+
+from flask import current_app, get_flashed_messages, render_template
+from flask import stream_with_context, before_render_template
+from flask import template_rendered
+from flask_wtf.csrf import generate_csrf
+from sqlalchemy.orm import Query
+
+from .cache import page_cache
+from .metrics import metrics
+
+
+def stream_template(template_name, **context):
+    '''渲染模板，返回流式的响应'''
+    app = current_app._get_current_object()
+    # 这里取出后缓存在请求上下文中，模板中再调用时直接返回这些消息
+    get_flashed_messages(with_categories=True)
+    # 表单的 CSRF 令牌第一次生成时也要写入会话
+    if app.config.get('WTF_CSRF_ENABLED', True):
+        generate_csrf()
+    # 查询对象改为分批读取，MySQL 上同时使用服务器端游标
+    for name, value in context.items():
+        if isinstance(value, Query):
+            context[name] = value.yield_per(app.config['STREAM_YIELD_PER'])
+    app.update_template_context(context)
+    template = app.jinja_env.get_or_select_template(template_name)
+
+    def generate():
+        before_render_template.send(app, template=template, context=context)
+        stream = template.stream(context)
+        stream.enable_buffering(app.config['STREAM_BUFFER_SIZE'])
+        for chunk in stream:
+            yield chunk
+        template_rendered.send(app, template=template, context=context)
+
+    return app.response_class(_Closing(stream_with_context(generate()),
+            metrics.defer()), mimetype='text/html')
+
+
+class _Closing:
+    '''响应体被关闭（发送完或客户端断开）之后调用 callback'''
+
+    def __init__(self, iterable, callback):
+        self.iterable = iterable
+        self.callback = callback
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        try:
+            self.iterable.close()
+        finally:
+            self.callback()
+
+
+def render_list(template_name, **context):
+    '''列表页面：可以整页缓存时整页渲染，否则流式渲染'''
+    if current_app.config['STREAM_TEMPLATES'] and not page_cache.cacheable():
+        return stream_template(template_name, **context)
+    return render_template(template_name, **context)